@@ -0,0 +1,180 @@
+"""
+Approximate nearest-neighbour index over the catalog's audio features.
+
+An inverted-file (IVF) index: k-means splits the feature vectors into
+``nlist`` clusters, and each cluster lists its track rows. A query ranks
+the centroids with the request's own weighted distance and returns the rows
+of the ``nprobe`` closest clusters as candidates. Those candidates are then
+scored exactly. Raising ``nprobe`` trades latency for recall.
+
+The recommender weights features differently per request, so a graph index
+built for one fixed metric (e.g. hnswlib) does not fit. Weighted distances
+to the centroids do.
+
+The index is built offline, stored inside the catalog's converted directory
+and memory-mapped at load time:
+
+    python ann.py tracks.csv [--nlist 2048]
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from catalog import directory_lock
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT = 1
+
+
+def nearest_centroids(x, centroids, chunk=65536):
+    """Index of the closest centroid (squared L2) for every row of ``x``."""
+    c2 = np.einsum("ij,ij->i", centroids, centroids)
+    assign = np.empty(len(x), dtype=np.int32)
+    for start in range(0, len(x), chunk):
+        block = np.asarray(x[start:start + chunk], dtype=np.float32)
+        assign[start:start + chunk] = np.argmin(c2 - 2.0 * (block @ centroids.T), axis=1)
+    return assign
+
+
+def kmeans(x, k, iterations=20, sample=200000, seed=0):
+    """Lloyd's k-means on up to ``sample`` rows of ``x``; returns (k x d) float32 centroids."""
+    rng = np.random.default_rng(seed)
+    data = x[np.sort(rng.choice(len(x), sample, replace=False))] if len(x) > sample else x
+    data = np.asarray(data, dtype=np.float32)
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = nearest_centroids(data, centroids)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.stack([np.bincount(assign, weights=data[:, d], minlength=k) for d in range(data.shape[1])], axis=1)
+        empty = counts == 0
+        centroids[~empty] = (sums[~empty] / counts[~empty, None]).astype(np.float32)
+        # Re-seed empty clusters on random points
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, centroids, order, offsets, meta=None):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.meta = meta or {}
+        self._c2 = np.asarray(centroids, dtype=np.float32) ** 2
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, x, nlist=0, iterations=20, meta=None):
+        """Index the rows of ``x`` (tracks x features); nlist=0 picks about 2*sqrt(rows)."""
+        nlist = nlist or max(1, int(2 * np.sqrt(len(x))))
+        centroids = kmeans(x, nlist, iterations=iterations)
+        assign = nearest_centroids(x, centroids)
+        order = np.argsort(assign, kind="stable").astype(np.int32)
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=len(centroids)), out=offsets[1:])
+        return cls(centroids, order, offsets, meta={**(meta or {}), "rows": len(x)})
+
+    def candidates(self, weights, weighted_targets, nprobe=16, min_count=1):
+        """
+        Rows in the ``nprobe`` clusters closest under sum_f w_f * (c_f - t_f)^2,
+        probing further clusters if that yields fewer than ``min_count`` rows.
+        ``weighted_targets`` is w * t, as used by the exact scorer.
+        """
+        scores = self._c2 @ weights - 2.0 * (self.centroids @ weighted_targets)
+        nprobe = max(1, min(nprobe, self.nlist))
+        while True:
+            if nprobe < self.nlist:
+                probe = np.argpartition(scores, nprobe - 1)[:nprobe]
+            else:
+                probe = np.arange(self.nlist)
+            sizes = self.offsets[probe + 1] - self.offsets[probe]
+            if sizes.sum() >= min_count or nprobe >= self.nlist:
+                break
+            nprobe = min(self.nlist, nprobe * 2)
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probe])
+
+    def save(self, directory):
+        tmp = f"{directory}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "centroids.npy"), np.asarray(self.centroids, dtype=np.float32))
+        np.save(os.path.join(tmp, "order.npy"), self.order)
+        np.save(os.path.join(tmp, "offsets.npy"), self.offsets)
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as fh:
+            json.dump({**self.meta, "format": INDEX_FORMAT, "nlist": self.nlist}, fh)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp, directory)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as fh:
+            meta = json.load(fh)
+        if meta.get("format") != INDEX_FORMAT:
+            raise ValueError(f"Unsupported ANN index format in {directory}")
+        return cls(
+            np.load(os.path.join(directory, "centroids.npy")),
+            np.load(os.path.join(directory, "order.npy"), mmap_mode="r"),
+            np.load(os.path.join(directory, "offsets.npy")),
+            meta=meta,
+        )
+
+
+def index_dir(catalog):
+    """Where the index for a converted catalog lives (None for in-memory catalogs)."""
+    return os.path.join(catalog.directory, "ivf") if catalog.directory else None
+
+
+def load_index(catalog):
+    """The saved index for ``catalog``, or None when missing or built for a different catalog."""
+    directory = index_dir(catalog)
+    if directory is None or not os.path.exists(os.path.join(directory, "meta.json")):
+        return None
+    try:
+        index = IVFIndex.load(directory)
+    except (OSError, ValueError) as exc:
+        logger.warning("Ignoring ANN index %s: %s", directory, exc)
+        return None
+    if index.meta.get("rows") != len(catalog):
+        logger.warning("Ignoring ANN index %s: built for a different catalog", directory)
+        return None
+    return index
+
+
+def build_index(catalog, nlist=0, iterations=20):
+    from recommendations import FeatureMatrix
+
+    matrix = FeatureMatrix.for_catalog(catalog)
+    index = IVFIndex.build(matrix.features().T, nlist=nlist, iterations=iterations)
+    directory = index_dir(catalog)
+    if directory:
+        with directory_lock(directory):
+            index.save(directory)
+    return index
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    import config
+    from catalog import load_catalog
+
+    parser = argparse.ArgumentParser(description="Build the IVF index for a track catalog.")
+    parser.add_argument("catalog", help="CSV, SQLite or Parquet track catalog")
+    parser.add_argument("--nlist", type=int, default=config.ANN_NLIST, help="clusters (default about 2*sqrt(tracks))")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    catalog = load_catalog(args.catalog, table=config.TRACK_CATALOG_TABLE)
+    started = time.perf_counter()
+    index = build_index(catalog, nlist=args.nlist, iterations=args.iterations)
+    print(f"{index.nlist} clusters over {len(catalog)} tracks in {time.perf_counter() - started:.1f}s -> {index_dir(catalog)}")
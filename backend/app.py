@@ -1,29 +1,35 @@
+import hashlib
 import os
 import time
-import base64
 from urllib.parse import urlencode
 
 from dotenv import load_dotenv
-from flask import Flask, redirect, request, session, jsonify
+from flask import Flask, Response, redirect, request, session, jsonify
 from flask_cors import CORS
 import requests
 
-from db import init_db
-from recommendations import get_recommendations_for_emotion
+import config
+import startup
+from caching import LoadingCache, TTLCache
+from catalog import add_reload_listener, catalog_generation, get_catalog
+from recommendations import EMOTION_MAPPING, EMOTIONS, build_target_params, get_recommendations_for_emotion
 from routes import emotion_bp
+from spotify import ClientCredentialsToken, basic_auth_header, create_session
 
 load_dotenv()
 
 app = Flask(__name__)
-app.secret_key = os.environ.get("SECRET_KEY", "dev-secret")
+app.secret_key = os.environ.get("SECRET_KEY", config.DEV_SECRET_KEY)
 
 CORS(
     app,
     resources={r"/api/*": {"origins": os.environ.get("BACKEND_CORS_ORIGINS", "*")}},
     supports_credentials=True,
+    expose_headers=["X-Next-Before"],
 )
 
-init_db()
+# Tables, indexes and model warm-up run in the startup phase, not at import
+startup.begin()
 
 @app.route("/")
 @app.route("/home")
@@ -34,37 +40,26 @@ SPOTIFY_CLIENT_ID = os.environ.get("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.environ.get("SPOTIFY_CLIENT_SECRET")
 SPOTIFY_REDIRECT_URI = os.environ.get("SPOTIFY_REDIRECT_URI", "http://localhost:5000/callback")
 SPOTIFY_AUTH_URL = "https://accounts.spotify.com/authorize"
-SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
-SPOTIFY_API_BASE = "https://api.spotify.com/v1"
+# Overridable so the Spotify calls can run against a local stub server
+SPOTIFY_TOKEN_URL = os.environ.get("SPOTIFY_TOKEN_URL", "https://accounts.spotify.com/api/token")
+SPOTIFY_API_BASE = os.environ.get("SPOTIFY_API_BASE", "https://api.spotify.com/v1").rstrip("/")
 SPOTIFY_ENABLED = bool(SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET)
 
-# Simple emotion -> audio feature mapping
-# Targets follow literature (valence ~ positivity, energy ~ arousal); seed genres guide mood. [9]
-EMOTION_MAPPING = {
-    "happy": dict(target_valence=0.85, target_energy=0.7, seed_genres=["pop", "dance"]),
-    "sad": dict(target_valence=0.2, target_energy=0.3, seed_genres=["acoustic", "indie"]),
-    "angry": dict(target_valence=0.2, target_energy=0.85, seed_genres=["metal", "rock"]),
-    "disgust": dict(target_valence=0.1, target_energy=0.4, seed_genres=["punk", "grunge"]),
-    "fear": dict(target_valence=0.25, target_energy=0.6, seed_genres=["ambient", "classical"]),
-    "surprise": dict(
-        target_valence=0.7, target_energy=0.8, seed_genres=["edm", "electronic"]
-    ),
-    "neutral": dict(target_valence=0.5, target_energy=0.5, seed_genres=["chill", "lofi"]),
-}
-
-# Optional: add constraints supported by Spotify recommendations (danceability, acousticness, loudness, tempo) [9]
-def build_target_params(emotion_cfg):
-    params = {
-        "target_valence": emotion_cfg["target_valence"],
-        "target_energy": emotion_cfg["target_energy"],
-    }
-    # Example heuristics: more acoustic for sad/fear; more danceable for happy/surprise. [9]
-    if emotion_cfg["seed_genres"] in ("acoustic", "indie", "ambient", "classical"):
-        params["max_loudness"] = -5
-        params["target_acousticness"] = 0.6
-    else:
-        params["target_danceability"] = 0.6
-    return params
+# One pooled keep-alive session for every Spotify call, and an app token
+# (client credentials) for the calls that do not act for a user
+spotify_http = create_session(
+    timeout=config.SPOTIFY_HTTP_TIMEOUT,
+    retries=config.SPOTIFY_HTTP_RETRIES,
+    backoff=config.SPOTIFY_HTTP_BACKOFF,
+    pool_size=config.SPOTIFY_HTTP_POOL_SIZE,
+    retry_after_max=config.SPOTIFY_RETRY_AFTER_MAX,
+)
+# Authorization codes are single use, so exchanging one is never retried
+spotify_code_http = create_session(timeout=config.SPOTIFY_HTTP_TIMEOUT, retries=0, pool_size=2)
+app_token = ClientCredentialsToken(
+    spotify_http, SPOTIFY_TOKEN_URL, SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET,
+    margin=config.SPOTIFY_TOKEN_REFRESH_MARGIN,
+)
 
 def ensure_spotify_configured():
     if not SPOTIFY_ENABLED:
@@ -72,26 +67,31 @@ def ensure_spotify_configured():
 
 def get_basic_auth_header():
     ensure_spotify_configured()
-    token = f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}"
-    b64 = base64.b64encode(token.encode()).decode()
-    return {"Authorization": f"Basic {b64}"}
+    return basic_auth_header(SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET)
 
 def token_headers():
     return {"Authorization": f"Bearer {session['access_token']}"}
 
+# Concurrent requests carrying the same refresh token share one refresh call
+user_token_refreshes = LoadingCache(maxsize=1024, ttl=30.0, name="spotify-token-refresh")
+
+def refresh_user_token(refresh_token):
+    data = {
+        "grant_type": "refresh_token",
+        "refresh_token": refresh_token,
+    }
+    res = spotify_http.post(SPOTIFY_TOKEN_URL, data=data, headers=get_basic_auth_header())
+    res.raise_for_status()
+    return res.json()
+
 def ensure_token():
     ensure_spotify_configured()
     # Refresh if token expired
     if "access_token" in session and time.time() < session.get("expires_at", 0) - 30:
         return
     if "refresh_token" in session:
-        data = {
-            "grant_type": "refresh_token",
-            "refresh_token": session["refresh_token"],
-        }
-        res = requests.post(SPOTIFY_TOKEN_URL, data=data, headers=get_basic_auth_header())
-        res.raise_for_status()
-        payload = res.json()
+        refresh_token = session["refresh_token"]
+        payload = user_token_refreshes.get(refresh_token, lambda: refresh_user_token(refresh_token))
         session["access_token"] = payload["access_token"]
         # some refresh responses omit refresh_token
         if "refresh_token" in payload:
@@ -126,7 +126,7 @@ def callback():
         "code": code,
         "redirect_uri": SPOTIFY_REDIRECT_URI,
     }
-    res = requests.post(SPOTIFY_TOKEN_URL, data=data, headers=get_basic_auth_header())
+    res = spotify_code_http.post(SPOTIFY_TOKEN_URL, data=data, headers=get_basic_auth_header())
     res.raise_for_status()
     payload = res.json()
     session["access_token"] = payload["access_token"]
@@ -138,18 +138,52 @@ def callback():
 def whoami():
     try:
         ensure_token()
-    except RuntimeError as exc:
+    except (RuntimeError, requests.RequestException) as exc:
         return jsonify({"error": str(exc)}), 503
-    r = requests.get(f"{SPOTIFY_API_BASE}/me", headers=token_headers())
+    r = spotify_http.get(f"{SPOTIFY_API_BASE}/me", headers=token_headers())
     return jsonify(r.json())
 
+# Spotify recommendations depend only on the request parameters, so they are
+# shared across users: fresh for SPOTIFY_CACHE_TTL seconds, then served stale
+# while one background call refreshes them
+recommendation_cache = LoadingCache(
+    maxsize=config.SPOTIFY_CACHE_SIZE,
+    ttl=config.SPOTIFY_CACHE_TTL,
+    stale_ttl=config.SPOTIFY_CACHE_STALE_TTL,
+    name="spotify-recommendations",
+)
+
+def fetch_recommendations(params):
+    r = spotify_http.get(f"{SPOTIFY_API_BASE}/recommendations", params=params, headers=app_token.headers())
+    if r.status_code == 401:
+        # Token revoked or expired early: fetch a new one and retry once
+        app_token.invalidate()
+        r = spotify_http.get(f"{SPOTIFY_API_BASE}/recommendations", params=params, headers=app_token.headers())
+    r.raise_for_status()
+    data = r.json()
+    # shape a compact response for frontend
+    return [
+        {
+            "id": t["id"],
+            "name": t["name"],
+            "artists": ", ".join(a["name"] for a in t["artists"]),
+            "album_image": (t["album"]["images"][0]["url"] if t["album"]["images"] else None),
+            "preview_url": t.get("preview_url"),
+            "external_url": t["external_urls"]["spotify"],
+        }
+        for t in data.get("tracks", [])
+    ]
+
 @app.route("/recommend")
 def recommend():
     if not SPOTIFY_ENABLED:
         return jsonify({"error": "Spotify credentials are not configured"}), 503
     # inputs: emotion, limit, market
     emotion = (request.args.get("emotion") or "neutral").lower()
-    limit = int(request.args.get("limit", 20))
+    try:
+        limit = int(request.args.get("limit", 20))
+    except (TypeError, ValueError):
+        limit = 20
     market = request.args.get("market", "IN")
     cfg = EMOTION_MAPPING.get(emotion, EMOTION_MAPPING["neutral"])
     targets = build_target_params(cfg)
@@ -157,49 +191,75 @@ def recommend():
     # For recommendations: need at least one of seed_artists, seed_genres, seed_tracks (up to 5 items) [1]
     seed_genres = ",".join(cfg["seed_genres"][:3])
     params = {
-        "limit": min(limit, 50),
+        "limit": min(max(limit, 1), 50),
         "market": market,
         "seed_genres": seed_genres,
         **targets,
     }
 
-    ensure_token()
-    r = requests.get(f"{SPOTIFY_API_BASE}/recommendations", params=params, headers=token_headers())
-    r.raise_for_status()
-    data = r.json()
-    # shape a compact response for frontend
-    tracks = [
-        {
-            "id": t["id"],
-            "name": t["name"],
-            "artists": ", ".join(a["name"] for a in t["artists"]),
-            "album_image": (t["album"]["images"]["url"] if t["album"]["images"] else None),
-            "preview_url": t.get("preview_url"),
-            "external_url": t["external_urls"]["spotify"],
-        }
-        for t in data.get("tracks", [])
-    ]
+    # Recommendations are not user specific, so they use the app token and
+    # work without a Spotify login
+    key = tuple(sorted(params.items()))
+    try:
+        tracks = recommendation_cache.get(key, lambda: fetch_recommendations(params))
+    except requests.RequestException as exc:
+        app.logger.warning(f"Spotify recommendations failed: {exc}")
+        return jsonify({"error": "Spotify request failed"}), 502
     return jsonify({"emotion": emotion, "params": params, "tracks": tracks})
 
 @app.route("/api/status")
 def status():
     return jsonify({"status": "ok"})
 
+@app.route("/api/ready")
+def ready():
+    state = startup.status()
+    return jsonify(state), (200 if state["ready"] else 503)
+
+# /api/recommendations only depends on its parameters and the catalog, so the
+# serialized body and its ETag are kept per (emotion, limit, confidence) and
+# dropped when the catalog is reloaded. Entries also record the catalog
+# generation they were built from, so one computed while a reload clears the
+# cache is not served.
+recommendation_responses = TTLCache(
+    maxsize=config.RECOMMENDATION_RESPONSE_CACHE_SIZE, ttl=config.RECOMMENDATION_RESPONSE_CACHE_TTL
+)
+add_reload_listener(recommendation_responses.clear)
+
 @app.route("/api/recommendations")
 def api_recommendations():
     emotion = (request.args.get("emotion") or "neutral").lower()
+    # Unknown labels are scored as neutral; share its cache entry
+    emotion = emotion if emotion in EMOTIONS else "neutral"
     try:
         limit = min(10, max(1, int(request.args.get("limit", 5))))
     except (TypeError, ValueError):
         limit = 5
-    tracks = get_recommendations_for_emotion(emotion, limit=limit)
-    return jsonify(
-        {
-            "emotion": emotion,
-            "limit": limit,
-            "tracks": tracks,
-        }
-    )
+    confidence = None
+    if "confidence" in request.args:
+        try:
+            # Rounded so the cache stays small; finer steps barely change the ranking
+            confidence = round(min(1.0, max(0.0, float(request.args["confidence"]))), 2)
+        except ValueError:
+            pass
+
+    key = (emotion, limit, confidence)
+    # get_catalog() first, so a changed catalog file is reloaded before the check
+    get_catalog()
+    generation = catalog_generation()
+    cached = recommendation_responses.get(key)
+    if cached is None or cached[2] != generation:
+        tracks = get_recommendations_for_emotion(emotion, limit=limit, confidence=confidence)
+        body = app.json.dumps({"emotion": emotion, "limit": limit, "tracks": tracks}).encode("utf-8")
+        cached = (body, hashlib.sha256(body).hexdigest()[:32], generation)
+        recommendation_responses.set(key, cached)
+
+    body, etag, _ = cached
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    # Clients may keep the body but must revalidate; unchanged results get a 304
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
 
 app.register_blueprint(emotion_bp, url_prefix="/api")
 
@@ -0,0 +1,66 @@
+"""
+Exact vs. approximate (IVF) recommendation: recall@k and latency.
+
+    python benchmark_ann.py --tracks 1000000
+    python benchmark_ann.py --catalog tracks.csv --nprobe 4 8 16 32
+
+Builds an IVF index over the catalog (the file given with --catalog, or a
+seeded synthetic one), then for random emotion distributions compares the
+top-k from exact scoring with the ANN top-k at each --nprobe setting,
+reporting recall@k and median/p99 latency.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ann import IVFIndex, build_index, load_index
+from benchmark_recommender import percentiles, synthetic_catalog
+from catalog import load_catalog
+from recommendations import EMOTIONS, FeatureMatrix, emotion_distribution, nearest_rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--catalog", help="CSV, SQLite or Parquet track catalog")
+    parser.add_argument("--tracks", type=int, default=1000000, help="synthetic catalog size (default 1000000)")
+    parser.add_argument("--nlist", type=int, default=0, help="clusters (default about 2*sqrt(tracks))")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    catalog = load_catalog(args.catalog) if args.catalog else synthetic_catalog(args.tracks)
+    matrix = FeatureMatrix(catalog)
+
+    started = time.perf_counter()
+    index = load_index(catalog) if args.catalog and not args.nlist else None
+    if index is None:
+        index = build_index(catalog, nlist=args.nlist) if args.catalog else IVFIndex.build(
+            matrix.features().T, nlist=args.nlist
+        )
+    print(f"{len(catalog)} tracks, {index.nlist} clusters (ready in {time.perf_counter() - started:.1f}s), top {args.limit}")
+
+    rng = np.random.default_rng(1)
+    dists = [emotion_distribution(probabilities=dict(zip(EMOTIONS, p))) for p in rng.dirichlet(np.ones(7), args.queries)]
+
+    exact, timings = [], []
+    for dist in dists:
+        started = time.perf_counter()
+        exact.append(set(nearest_rows(matrix, dist, args.limit).tolist()))
+        timings.append(time.perf_counter() - started)
+    print(f"exact            recall 1.000  {percentiles(timings)}")
+
+    for nprobe in args.nprobe:
+        hits, timings = 0, []
+        for dist, truth in zip(dists, exact):
+            started = time.perf_counter()
+            rows = nearest_rows(matrix, dist, args.limit, index=index, nprobe=nprobe)
+            timings.append(time.perf_counter() - started)
+            hits += len(truth.intersection(rows.tolist()))
+        recall = hits / float(args.limit * len(dists))
+        print(f"nprobe={nprobe:<4}      recall {recall:.3f}  {percentiles(timings)}")
+
+
+if __name__ == "__main__":
+    main()
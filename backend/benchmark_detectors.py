@@ -0,0 +1,71 @@
+"""
+Benchmark the face detectors across input sizes.
+
+    python benchmark_detectors.py --image group_photo.jpg
+    python benchmark_detectors.py --sizes 640 1280 4032 --max-side 0 640
+
+The source image (a seeded noise image when --image is omitted, which times the
+scan but finds no faces) is resized to each longest-side size, then every
+detector is run with each --max-side downscaling setting, reporting median
+latency and the number of faces found.
+"""
+import argparse
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from emotion import FACE_DETECTORS, create_face_detector, detect_faces
+
+
+def resize_longest(image, side):
+    height, width = image.shape[:2]
+    scale = side / float(max(height, width))
+    return cv2.resize(image, (int(round(width * scale)), int(round(height * scale))), interpolation=cv2.INTER_AREA)
+
+
+def time_detector(detector, image, max_side, repeats):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    faces = detect_faces(detector, image, gray, max_side=max_side)  # warm-up
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        detect_faces(detector, image, gray, max_side=max_side)
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return float(np.median(timings)), len(faces)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", help="photo to benchmark on")
+    parser.add_argument("--detectors", nargs="+", choices=sorted(FACE_DETECTORS), default=sorted(FACE_DETECTORS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[480, 720, 1080, 1920, 4032])
+    parser.add_argument("--max-side", nargs="+", type=int, default=[0, 640])
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    if args.image:
+        source = cv2.imread(args.image, cv2.IMREAD_COLOR)
+        if source is None:
+            parser.error(f"Unable to read {args.image}")
+    else:
+        source = np.random.default_rng(0).integers(0, 256, (3024, 4032, 3), dtype=np.uint8)
+
+    print(f"{'detector':<8} {'size':>6} {'max side':>9} {'median ms':>10} {'faces':>6}")
+    for name in args.detectors:
+        try:
+            detector = create_face_detector(name)
+        except (RuntimeError, FileNotFoundError) as exc:
+            print(f"{name:<8} skipped: {exc}")
+            continue
+        for size in args.sizes:
+            image = resize_longest(source, size)
+            for max_side in args.max_side:
+                median, found = time_detector(detector, image, max_side, args.repeats)
+                print(f"{name:<8} {size:>6} {max_side or 'off':>9} {median:10.2f} {found:>6}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Compare the float and int8-quantized emotion models.
+
+    python benchmark_quantization.py --faces faces/
+    python benchmark_quantization.py --float-backend tflite
+
+Reports per-image latency (batch of one, as served per face), the model file
+size and resident memory added by loading it, and top-1 agreement of the int8
+model with the float model on a fixed set of face crops (photos under --faces,
+or a seeded random set when none are given).
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from export_model import EXPORT_PATHS, KERAS_PATH, load_face_crops, random_crops
+from inference import load_predictor
+
+MODEL_PATHS = {"keras": KERAS_PATH, "function": KERAS_PATH, **EXPORT_PATHS}
+
+
+def resident_mb():
+    """Current resident set size in MB (Linux /proc, falling back to peak RSS)."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def benchmark(backend, crops, repeats):
+    path = MODEL_PATHS[backend]
+    before = resident_mb()
+    predict = load_predictor(backend, path)
+    predict(crops[:1])  # warm-up, also allocates the interpreter tensors
+    loaded = resident_mb() - before
+
+    outputs, timings = [], []
+    for _ in range(repeats):
+        for crop in crops:
+            start = time.perf_counter()
+            outputs.append(np.asarray(predict(crop[np.newaxis]))[0])
+            timings.append((time.perf_counter() - start) * 1000.0)
+    timings = np.array(timings)
+    return {
+        "backend": backend,
+        "file_mb": os.path.getsize(path) / 2**20,
+        "rss_mb": loaded,
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p95_ms": float(np.percentile(timings, 95)),
+        "predictions": np.stack(outputs[: len(crops)]),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faces", help="directory of face photos; crops are detected with the Haar cascade")
+    parser.add_argument("--samples", type=int, default=200, help="number of random crops without --faces")
+    parser.add_argument("--float-backend", default="keras", choices=["keras", "function", "tflite", "onnx"])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    crops = load_face_crops(args.faces) if args.faces else random_crops(args.samples)
+    reference = benchmark(args.float_backend, crops, args.repeats)
+    quantized = benchmark("tflite_int8", crops, args.repeats)
+    agreement = float(
+        np.mean(reference["predictions"].argmax(axis=1) == quantized["predictions"].argmax(axis=1))
+    )
+
+    print(f"{len(crops)} face crops, {args.repeats} repeats")
+    print(f"{'backend':<12} {'file MB':>8} {'RSS MB':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for result in (reference, quantized):
+        print(
+            f"{result['backend']:<12} {result['file_mb']:8.2f} {result['rss_mb']:8.1f} "
+            f"{result['p50_ms']:8.3f} {result['p95_ms']:8.3f}"
+        )
+    print(f"top-1 agreement int8 vs {args.float_backend}: {agreement:.1%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
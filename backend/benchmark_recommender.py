@@ -0,0 +1,73 @@
+"""
+Latency of the local nearest-neighbour recommender.
+
+    python benchmark_recommender.py --tracks 100000
+    python benchmark_recommender.py --catalog tracks.csv
+
+Scores a catalog (the file given with --catalog, or a seeded synthetic one
+with --tracks rows) against blended emotion targets and reports the median
+and p99 time for scoring + top-k selection, and for the full call that also
+builds the track dicts.
+"""
+import argparse
+import time
+
+import numpy as np
+
+import config
+from catalog import TrackCatalog, load_catalog
+from recommendations import EMOTIONS, FeatureMatrix, emotion_distribution, top_k
+
+
+def synthetic_catalog(n, seed=0):
+    rng = np.random.default_rng(seed)
+    features = {
+        "valence": rng.random(n, dtype=np.float32),
+        "energy": rng.random(n, dtype=np.float32),
+        "danceability": rng.random(n, dtype=np.float32),
+        "acousticness": rng.random(n, dtype=np.float32),
+        "tempo": rng.uniform(60, 180, n).astype(np.float32),
+    }
+    emotions = rng.choice(EMOTIONS, n)
+    records = (
+        {"id": f"track-{i}", "name": f"Track {i}", "artists": "Artist", "emotion": emotions[i],
+         **{column: values[i] for column, values in features.items()}}
+        for i in range(n)
+    )
+    return TrackCatalog.from_records(records, source="synthetic")
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000.0
+    return f"median {np.median(samples):.3f} ms, p99 {np.percentile(samples, 99):.3f} ms"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--catalog", help="CSV, SQLite or Parquet track catalog")
+    parser.add_argument("--tracks", type=int, default=100000, help="synthetic catalog size (default 100000)")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    catalog = load_catalog(args.catalog) if args.catalog else synthetic_catalog(args.tracks)
+    matrix = FeatureMatrix(catalog)
+    rng = np.random.default_rng(1)
+    dists = [emotion_distribution(probabilities=dict(zip(EMOTIONS, p))) for p in rng.dirichlet(np.ones(7), 64)]
+
+    scoring, full = [], []
+    for i in range(args.repeats):
+        dist = dists[i % len(dists)]
+        started = time.perf_counter()
+        rows = top_k(matrix.scores(dist, label_weight=config.RECOMMENDER_LABEL_WEIGHT), args.limit)
+        scoring.append(time.perf_counter() - started)
+        catalog.tracks(rows)
+        full.append(time.perf_counter() - started)
+
+    print(f"{len(catalog)} tracks, top {args.limit}")
+    print(f"score + top-k:      {percentiles(scoring)}")
+    print(f"with track dicts:   {percentiles(full)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+In-process caches for hot read paths.
+
+TTLCache is a thread-safe mapping whose entries expire ``ttl`` seconds after
+they are set and which evicts the least recently used entry once it holds
+``maxsize`` items. LoadingCache adds read-through loading for slow upstream
+calls: concurrent misses share one load, and recently expired entries are
+served while a background refresh runs. Each worker process has its own
+cache, so explicit invalidation only reaches the local process; the TTL
+bounds how stale the other workers can be.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _MISSING:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class _Flight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class LoadingCache:
+    """
+    TTL + LRU cache that fills itself through a loader callable.
+
+    ``get(key, loader)`` returns a cached value younger than ``ttl``. On a miss
+    one caller runs ``loader()`` and concurrent callers for the same key wait
+    for its result (single flight). Values older than ``ttl`` but younger than
+    ``ttl + stale_ttl`` are returned at once while a background thread reloads
+    them; if that reload fails the stale value stays in place.
+    """
+
+    def __init__(self, maxsize=256, ttl=300.0, stale_ttl=0.0, name="cache"):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.name = name
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0, "loads": 0, "load_errors": 0}
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = now - entry[0]
+                if age < self.ttl:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry[1]
+                if age < self.ttl + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    self._stats["stale_hits"] += 1
+                    if key not in self._inflight:
+                        flight = self._inflight[key] = _Flight()
+                        threading.Thread(
+                            target=self._load, args=(key, loader, flight),
+                            name=f"{self.name}-refresh", daemon=True,
+                        ).start()
+                    return entry[1]
+                del self._entries[key]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self._stats["misses"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if leader:
+            self._load(key, loader, flight)
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _load(self, key, loader, flight):
+        try:
+            flight.value = loader()
+        except Exception as exc:
+            flight.error = exc
+            logger.warning("%s: load for %r failed: %s", self.name, key, exc)
+        finally:
+            with self._lock:
+                if flight.error is None:
+                    self._entries[key] = (time.monotonic(), flight.value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+                    self._stats["loads"] += 1
+                else:
+                    self._stats["load_errors"] += 1
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize, "in_flight": len(self._inflight), **self._stats}
@@ -0,0 +1,323 @@
+"""
+Columnar track catalog for local recommendations.
+
+TRACK_CATALOG_PATH points at a CSV, SQLite (table TRACK_CATALOG_TABLE) or
+Parquet file with one row per track. The columns are the track fields
+returned to clients (id, name, artists, album_image, preview_url,
+external_url), the audio features (valence, energy, danceability,
+acousticness, tempo) and the categories (emotion, language, region).
+
+On first use the file is converted into a directory of .npy arrays:
+- float32 feature columns;
+- text columns as one UTF-8 blob plus offsets;
+- categories as interned codes.
+Later loads memory-map these arrays, so startup stays fast and worker
+processes share the same pages. The conversion is redone when the source
+file changes, and a running process notices the change within
+TRACK_CATALOG_CHECK_INTERVAL seconds and reloads. Without a catalog file the
+built-in RECOMMENDATION_LIBRARY is used.
+"""
+import csv
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+import config
+
+logger = logging.getLogger(__name__)
+
+FEATURE_COLUMNS = ("valence", "energy", "danceability", "acousticness", "tempo")
+TEXT_COLUMNS = ("id", "name", "artists", "album_image", "preview_url", "external_url")
+CATEGORY_COLUMNS = ("emotion", "language", "region")
+CACHE_FORMAT = 1
+
+
+def _normalize(column, value):
+    value = "" if value is None else str(value).strip()
+    return value.upper() if column == "region" else value.lower()
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class TrackCatalog:
+    """
+    Columnar catalog. ``features`` maps each audio feature to a float32
+    array; ``codes``/``tables`` hold interned categories (code 0 is the empty
+    value).
+    """
+
+    def __init__(self, features, text, codes, tables, source=None):
+        self.features = features
+        self._text = text
+        self.codes = codes
+        self.tables = tables
+        self._lookup = {column: {value: code for code, value in enumerate(table)} for column, table in tables.items()}
+        self.source = source
+        # Set for catalogs memory-mapped from a converted directory
+        self.directory = None
+
+    def __len__(self):
+        return len(self.features[FEATURE_COLUMNS[0]])
+
+    @classmethod
+    def from_records(cls, records, source=None):
+        records = list(records)
+        features = {
+            column: np.array([_to_float(r.get(column)) for r in records], dtype=np.float32)
+            for column in FEATURE_COLUMNS
+        }
+        text = {}
+        for column in TEXT_COLUMNS:
+            encoded = [("" if r.get(column) is None else str(r.get(column))).encode("utf-8") for r in records]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(e) for e in encoded], out=offsets[1:])
+            text[column] = (np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+        codes, tables = {}, {}
+        for column in CATEGORY_COLUMNS:
+            table, lookup = [""], {"": 0}
+            column_codes = np.empty(len(records), dtype=np.int32)
+            for i, r in enumerate(records):
+                value = _normalize(column, r.get(column))
+                code = lookup.get(value)
+                if code is None:
+                    code = lookup[value] = len(table)
+                    table.append(value)
+                column_codes[i] = code
+            codes[column], tables[column] = column_codes, table
+        return cls(features, text, codes, tables, source=source)
+
+    def code(self, column, value):
+        """Interned code of ``value`` in a category column, or None when absent."""
+        return self._lookup[column].get(_normalize(column, value))
+
+    def text(self, column, row):
+        blob, offsets = self._text[column]
+        return bytes(blob[offsets[row]:offsets[row + 1]]).decode("utf-8")
+
+    def track(self, row):
+        """Client-facing track dict for one row; empty fields become None."""
+        return {column: (self.text(column, row) or None) for column in TEXT_COLUMNS}
+
+    def tracks(self, rows):
+        return [self.track(int(row)) for row in rows]
+
+    def save(self, directory, meta=None):
+        """
+        Write the arrays to ``directory`` (built next to it, then renamed).
+        Callers in worker processes hold directory_lock(directory).
+        """
+        tmp = f"{directory}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for column, values in self.features.items():
+            np.save(os.path.join(tmp, f"feature_{column}.npy"), values)
+        for column, (blob, offsets) in self._text.items():
+            np.save(os.path.join(tmp, f"text_{column}.npy"), blob)
+            np.save(os.path.join(tmp, f"text_{column}_offsets.npy"), offsets)
+        for column, values in self.codes.items():
+            np.save(os.path.join(tmp, f"codes_{column}.npy"), values)
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as fh:
+            json.dump({**(meta or {}), "format": CACHE_FORMAT, "rows": len(self), "tables": self.tables}, fh)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp, directory)
+
+    @classmethod
+    def load(cls, directory, source=None):
+        """Memory-map a directory written by save()."""
+        def array(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as fh:
+            meta = json.load(fh)
+        features = {column: array(f"feature_{column}") for column in FEATURE_COLUMNS}
+        text = {column: (array(f"text_{column}"), array(f"text_{column}_offsets")) for column in TEXT_COLUMNS}
+        codes = {column: array(f"codes_{column}") for column in CATEGORY_COLUMNS}
+        catalog = cls(features, text, codes, meta["tables"], source=source)
+        catalog.directory = directory
+        return catalog
+
+
+@contextmanager
+def directory_lock(directory):
+    """
+    Exclusive lock on ``<directory>.lock`` shared by all worker processes, held
+    while a converted directory is checked and rebuilt (not re-entrant).
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(directory)), exist_ok=True)
+    with open(f"{directory}.lock", "a") as fh:
+        if fcntl is not None:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def read_records(path, table="tracks"):
+    """Rows of a CSV, SQLite or Parquet catalog file as dicts."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".db", ".sqlite", ".sqlite3"):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            conn.row_factory = sqlite3.Row
+            return [dict(row) for row in conn.execute(f'SELECT * FROM "{table}"')]
+        finally:
+            conn.close()
+    if ext == ".parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Reading a Parquet catalog requires pyarrow")
+        return pq.read_table(path).to_pylist()
+    with open(path, newline="", encoding="utf-8") as fh:
+        return list(csv.DictReader(fh))
+
+
+def _cache_dir(path):
+    return config.TRACK_CATALOG_CACHE_DIR or f"{path}.catalog"
+
+
+def load_catalog(path, table="tracks"):
+    """Memory-map the converted catalog for ``path``, converting it first if it is missing or stale."""
+    stat = os.stat(path)
+    meta = {"source": os.path.abspath(path), "mtime": stat.st_mtime, "size": stat.st_size}
+    directory = _cache_dir(path)
+    if _is_current(directory, meta):
+        return TrackCatalog.load(directory, source=path)
+
+    # Workers that find the catalog stale at the same time convert it once
+    with directory_lock(directory):
+        if not _is_current(directory, meta):
+            logger.info("Converting track catalog %s into %s", path, directory)
+            TrackCatalog.from_records(read_records(path, table=table), source=path).save(directory, meta=meta)
+        return TrackCatalog.load(directory, source=path)
+
+
+def _is_current(directory, meta):
+    try:
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as fh:
+            cached = json.load(fh)
+    except (OSError, ValueError):
+        return False
+    return cached.get("format") == CACHE_FORMAT and all(cached.get(k) == v for k, v in meta.items())
+
+
+def _builtin_catalog():
+    from recommendations import RECOMMENDATION_LIBRARY, TARGET_FEATURES, emotion_targets
+
+    records = []
+    for emotion, tracks in RECOMMENDATION_LIBRARY.items():
+        # The built-in tracks carry no audio features; place them on their emotion's targets
+        targets, weights = emotion_targets(emotion)
+        features = {f: float(t) for f, t, w in zip(TARGET_FEATURES, targets, weights) if w}
+        records.extend({**track, **features, "emotion": emotion} for track in tracks)
+    return TrackCatalog.from_records(records, source="builtin")
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+_catalog_stat = None
+_reload_listeners = []
+# Bumped by every reload; caches derived from the catalog store it and
+# compare on read (object ids can be reused once the old catalog is freed)
+_generation = 0
+_next_check = 0.0
+_check_lock = threading.Lock()
+
+
+def catalog_generation():
+    """Counter that changes whenever reload_catalog() replaces the catalog."""
+    return _generation
+
+
+def add_reload_listener(callback):
+    """Call ``callback()`` whenever reload_catalog() replaces the catalog (e.g. to drop derived caches)."""
+    _reload_listeners.append(callback)
+
+
+def _source_stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+def get_catalog():
+    """Process-wide catalog, loaded on first use and reloaded when its source file changes."""
+    global _catalog, _catalog_stat
+    if _catalog is not None and config.TRACK_CATALOG_CHECK_INTERVAL:
+        _check_source()
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                path = config.TRACK_CATALOG_PATH
+                _catalog_stat = _source_stat(path) if path else None
+                if _catalog_stat is not None:
+                    _catalog = load_catalog(path, table=config.TRACK_CATALOG_TABLE)
+                else:
+                    if path:
+                        logger.warning("Track catalog %s not found; using the built-in library", path)
+                    _catalog = _builtin_catalog()
+    return _catalog
+
+
+def _check_source():
+    """Reload when TRACK_CATALOG_PATH changed; stats the file at most once per interval."""
+    global _next_check
+    now = time.monotonic()
+    if now < _next_check or not _check_lock.acquire(blocking=False):
+        return
+    try:
+        if now < _next_check:
+            return
+        _next_check = now + config.TRACK_CATALOG_CHECK_INTERVAL
+        path = config.TRACK_CATALOG_PATH
+        if path and _source_stat(path) != _catalog_stat:
+            logger.info("Track catalog %s changed; reloading", path)
+            reload_catalog()
+    finally:
+        _check_lock.release()
+
+
+def reload_catalog():
+    """Drop the loaded catalog (e.g. after the file was replaced) and load it again."""
+    global _catalog, _generation
+    with _catalog_lock:
+        _catalog = None
+    catalog = get_catalog()
+    # Bumped only once the new catalog is in place, so a request that read the
+    # new generation never computes from the old catalog
+    _generation += 1
+    for callback in list(_reload_listeners):
+        callback()
+    return catalog
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        sys.exit("usage: python catalog.py <tracks.csv|tracks.db|tracks.parquet>")
+    catalog = load_catalog(sys.argv[1], table=config.TRACK_CATALOG_TABLE)
+    print(f"{len(catalog)} tracks in {_cache_dir(sys.argv[1])}")
+    for column in CATEGORY_COLUMNS:
+        print(f"{column}: {len(catalog.tables[column]) - 1} values")
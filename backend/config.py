@@ -0,0 +1,184 @@
+"""
+Runtime configuration for the MoodTunes backend, read from the environment.
+"""
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env_bool(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# Persistence: mongo (MongoDB, MONGODB_URL) or sql (SQLAlchemy, DATABASE_URL;
+# SQLite by default)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "mongo").strip().lower()
+
+# MongoDB connection pool, timeouts (ms) and health checking: the client pings
+# every MONGO_HEALTH_INTERVAL seconds; the circuit breaker opens after
+# MONGO_BREAKER_THRESHOLD failed calls and retries after MONGO_BREAKER_RESET seconds
+MONGO_MAX_POOL_SIZE = max(1, _env_int("MONGO_MAX_POOL_SIZE", 50))
+MONGO_MIN_POOL_SIZE = max(0, _env_int("MONGO_MIN_POOL_SIZE", 0))
+MONGO_MAX_IDLE_TIME_MS = max(0, _env_int("MONGO_MAX_IDLE_TIME_MS", 60000)) or None
+MONGO_SERVER_SELECTION_TIMEOUT_MS = max(1, _env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 2000))
+MONGO_CONNECT_TIMEOUT_MS = max(1, _env_int("MONGO_CONNECT_TIMEOUT_MS", 2000))
+MONGO_SOCKET_TIMEOUT_MS = max(1, _env_int("MONGO_SOCKET_TIMEOUT_MS", 5000))
+MONGO_HEALTH_INTERVAL = max(0.5, _env_float("MONGO_HEALTH_INTERVAL", 5.0))
+MONGO_BREAKER_THRESHOLD = max(1, _env_int("MONGO_BREAKER_THRESHOLD", 3))
+MONGO_BREAKER_RESET = max(0.5, _env_float("MONGO_BREAKER_RESET", 10.0))
+
+# Emotion model backend: keras, function (cached tf.function), tflite,
+# tflite_int8 (post-training int8 quantized) or onnx. EMOTION_MODEL_PATH
+# overrides the default model.h5 / model.tflite / model_int8.tflite / model.onnx.
+EMOTION_BACKEND = os.environ.get("EMOTION_BACKEND", "keras").strip().lower()
+EMOTION_MODEL_PATH = os.environ.get("EMOTION_MODEL_PATH")
+
+# Face detector: haar (default) or yunet (OpenCV DNN, needs the ONNX file
+# models/face_detection_yunet_2023mar.onnx or YUNET_MODEL_PATH; see
+# README_SETUP.md; without it yunet falls back to haar with a warning).
+# Inputs are downscaled to FACE_DETECTOR_MAX_SIDE pixels before detection (0 disables).
+FACE_DETECTOR = os.environ.get("FACE_DETECTOR", "haar").strip().lower()
+FACE_DETECTOR_MAX_SIDE = max(0, _env_int("FACE_DETECTOR_MAX_SIDE", 640))
+YUNET_MODEL_PATH = os.environ.get("YUNET_MODEL_PATH")
+
+# Live video: run the face detector every N frames and track faces in between
+TRACKER_DETECT_EVERY = max(1, _env_int("TRACKER_DETECT_EVERY", 10))
+
+# Temporal smoothing for live sessions: EMA weight of each new frame, lead the
+# challenger needs over the current emotion, and frames it must hold that lead
+SMOOTHING_ALPHA = min(1.0, max(0.01, _env_float("SMOOTHING_ALPHA", 0.3)))
+SMOOTHING_MARGIN = max(0.0, _env_float("SMOOTHING_MARGIN", 0.1))
+SMOOTHING_MIN_FRAMES = max(1, _env_int("SMOOTHING_MIN_FRAMES", 3))
+SMOOTHING_MAX_SESSIONS = max(1, _env_int("SMOOTHING_MAX_SESSIONS", 1024))
+
+# Cross-request micro-batching of emotion model inference; a request waits at
+# most INFERENCE_RESULT_TIMEOUT seconds for its batch
+INFERENCE_BATCHING = _env_bool("INFERENCE_BATCHING", False)
+INFERENCE_BATCH_SIZE = max(1, _env_int("INFERENCE_BATCH_SIZE", 16))
+INFERENCE_MAX_WAIT_MS = max(0.0, _env_float("INFERENCE_MAX_WAIT_MS", 5.0))
+INFERENCE_RESULT_TIMEOUT = max(0.1, _env_float("INFERENCE_RESULT_TIMEOUT", 30.0))
+
+# Startup warm-up of the model and databases: background, blocking or off
+WARMUP_MODE = os.environ.get("WARMUP_MODE", "background").strip().lower()
+
+# Live emotion streams (/api/stream): shared worker threads, seconds before an
+# idle stream is dropped, and the per-process stream cap
+STREAM_WORKERS = max(1, _env_int("STREAM_WORKERS", 2))
+STREAM_IDLE_TIMEOUT = max(1.0, _env_float("STREAM_IDLE_TIMEOUT", 30.0))
+STREAM_MAX_STREAMS = max(1, _env_int("STREAM_MAX_STREAMS", 32))
+
+# Uploaded image storage for mood records: local (content-addressed blob
+# directory), gridfs or none. Images are stored as JPEG thumbnails whose longest
+# side is IMAGE_STORE_MAX_SIDE pixels (0 keeps full size).
+IMAGE_STORE = os.environ.get("IMAGE_STORE", "local").strip().lower()
+IMAGE_STORE_DIR = os.environ.get(
+    "IMAGE_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "image_store")
+)
+IMAGE_STORE_MAX_SIDE = max(0, _env_int("IMAGE_STORE_MAX_SIDE", 256))
+
+# Write-behind persistence for /api/detect: flush when this many writes are
+# queued or every FLUSH_INTERVAL seconds; retry transient MongoDB errors
+WRITE_BEHIND = _env_bool("WRITE_BEHIND", True)
+WRITE_BEHIND_BATCH_SIZE = max(1, _env_int("WRITE_BEHIND_BATCH_SIZE", 100))
+WRITE_BEHIND_FLUSH_INTERVAL = max(0.01, _env_float("WRITE_BEHIND_FLUSH_INTERVAL", 0.5))
+WRITE_BEHIND_MAX_QUEUE = max(1, _env_int("WRITE_BEHIND_MAX_QUEUE", 10000))
+WRITE_BEHIND_MAX_RETRIES = max(0, _env_int("WRITE_BEHIND_MAX_RETRIES", 3))
+
+# Password hashing: werkzeug method string (sets the work factor, e.g.
+# "scrypt:32768:8:1" or "pbkdf2:sha256:600000"), dedicated hashing threads and
+# backlog, and per-email login attempts allowed per window (seconds)
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt")
+PASSWORD_HASH_WORKERS = max(1, _env_int("PASSWORD_HASH_WORKERS", 2))
+PASSWORD_HASH_MAX_PENDING = max(1, _env_int("PASSWORD_HASH_MAX_PENDING", 32))
+LOGIN_MAX_ATTEMPTS = max(1, _env_int("LOGIN_MAX_ATTEMPTS", 10))
+LOGIN_ATTEMPT_WINDOW = max(1.0, _env_float("LOGIN_ATTEMPT_WINDOW", 300.0))
+
+# Session tokens: /api/auth/login issues HS256 tokens signed with SECRET_KEY,
+# valid for AUTH_TOKEN_TTL seconds. With AUTH_REQUIRED, routes no longer accept
+# a bare email parameter without a matching token. User and preference
+# documents are cached per process for USER_CACHE_TTL seconds. No tokens are
+# issued or accepted while SECRET_KEY is unset (DEV_SECRET_KEY is public).
+DEV_SECRET_KEY = "dev-secret"
+AUTH_TOKEN_TTL = max(60, _env_int("AUTH_TOKEN_TTL", 86400))
+AUTH_REQUIRED = _env_bool("AUTH_REQUIRED", False)
+USER_CACHE_TTL = max(0.0, _env_float("USER_CACHE_TTL", 60.0))
+USER_CACHE_SIZE = max(1, _env_int("USER_CACHE_SIZE", 10000))
+
+# Spotify /recommend cache: responses are fresh for SPOTIFY_CACHE_TTL seconds
+# and may then be served for SPOTIFY_CACHE_STALE_TTL more while refreshing
+SPOTIFY_CACHE_TTL = max(0.0, _env_float("SPOTIFY_CACHE_TTL", 300.0))
+SPOTIFY_CACHE_STALE_TTL = max(0.0, _env_float("SPOTIFY_CACHE_STALE_TTL", 3600.0))
+SPOTIFY_CACHE_SIZE = max(1, _env_int("SPOTIFY_CACHE_SIZE", 256))
+
+# Spotify HTTP client: per-request timeout (seconds), retries with exponential
+# backoff on 429/5xx (Retry-After honoured up to SPOTIFY_RETRY_AFTER_MAX
+# seconds), keep-alive pool size, and how early the app token is refreshed
+SPOTIFY_HTTP_TIMEOUT = max(0.1, _env_float("SPOTIFY_HTTP_TIMEOUT", 10.0))
+SPOTIFY_HTTP_RETRIES = max(0, _env_int("SPOTIFY_HTTP_RETRIES", 3))
+SPOTIFY_HTTP_BACKOFF = max(0.0, _env_float("SPOTIFY_HTTP_BACKOFF", 0.5))
+SPOTIFY_HTTP_POOL_SIZE = max(1, _env_int("SPOTIFY_HTTP_POOL_SIZE", 10))
+SPOTIFY_RETRY_AFTER_MAX = max(0.0, _env_float("SPOTIFY_RETRY_AFTER_MAX", 30.0))
+SPOTIFY_TOKEN_REFRESH_MARGIN = max(0.0, _env_float("SPOTIFY_TOKEN_REFRESH_MARGIN", 60.0))
+
+# Local track catalog (CSV, SQLite or Parquet; empty uses the built-in library).
+# It is converted once into memory-mappable arrays in TRACK_CATALOG_CACHE_DIR
+# (default: "<path>.catalog" next to the file). The file is checked for changes
+# at most every TRACK_CATALOG_CHECK_INTERVAL seconds (0 disables reloading).
+TRACK_CATALOG_PATH = os.environ.get("TRACK_CATALOG_PATH", "")
+TRACK_CATALOG_TABLE = os.environ.get("TRACK_CATALOG_TABLE", "tracks")
+TRACK_CATALOG_CACHE_DIR = os.environ.get("TRACK_CATALOG_CACHE_DIR", "")
+TRACK_CATALOG_CHECK_INTERVAL = max(0.0, _env_float("TRACK_CATALOG_CHECK_INTERVAL", 30.0))
+
+# Local recommender: score bonus for tracks whose catalog emotion label is
+# likely under the detected probabilities (0 ranks on audio features only), and
+# the least weight a requested emotion gets when its confidence is low (the rest
+# is blended towards neutral)
+RECOMMENDER_LABEL_WEIGHT = max(0.0, _env_float("RECOMMENDER_LABEL_WEIGHT", 0.25))
+RECOMMENDER_MIN_EMOTION_SHARE = min(1.0, max(0.0, _env_float("RECOMMENDER_MIN_EMOTION_SHARE", 0.6)))
+
+# Approximate nearest-neighbour index (build with "python ann.py <catalog>"):
+# used when built and the catalog has at least ANN_MIN_TRACKS tracks. Each
+# request scores the tracks of the ANN_NPROBE closest of ANN_NLIST clusters
+# (0 picks about 2*sqrt(tracks)); more probes = higher recall, more latency.
+ANN_INDEX = _env_bool("ANN_INDEX", True)
+ANN_MIN_TRACKS = max(0, _env_int("ANN_MIN_TRACKS", 200000))
+ANN_NPROBE = max(1, _env_int("ANN_NPROBE", 16))
+ANN_NLIST = max(0, _env_int("ANN_NLIST", 0))
+
+# Personalized re-ranking for signed-in users: candidate pool of
+# RERANK_POOL_FACTOR x limit tracks, relevance boosts for the user's
+# language/region, MMR diversity weight (0 = relevance only), and the per-user
+# cache of recently served tracks that are skipped (seeded from mood history).
+# Only candidates scoring within RERANK_MAX_SCORE_GAP of the best one (weighted
+# squared feature distance) are re-ranked, so skipped tracks are not replaced by
+# tracks of a different mood.
+RERANK_POOL_FACTOR = max(1, _env_int("RERANK_POOL_FACTOR", 5))
+RERANK_MAX_SCORE_GAP = max(0.0, _env_float("RERANK_MAX_SCORE_GAP", 0.1))
+RERANK_LANGUAGE_BOOST = max(0.0, _env_float("RERANK_LANGUAGE_BOOST", 0.2))
+RERANK_REGION_BOOST = max(0.0, _env_float("RERANK_REGION_BOOST", 0.1))
+RERANK_DIVERSITY = min(1.0, max(0.0, _env_float("RERANK_DIVERSITY", 0.3)))
+RECENT_TRACKS_PER_USER = max(1, _env_int("RECENT_TRACKS_PER_USER", 50))
+RECENT_TRACKS_TTL = max(1.0, _env_float("RECENT_TRACKS_TTL", 900.0))
+
+# Serialized /api/recommendations responses (with ETags), cleared on catalog reload
+RECOMMENDATION_RESPONSE_CACHE_SIZE = max(1, _env_int("RECOMMENDATION_RESPONSE_CACHE_SIZE", 2048))
+RECOMMENDATION_RESPONSE_CACHE_TTL = max(0.0, _env_float("RECOMMENDATION_RESPONSE_CACHE_TTL", 3600.0))
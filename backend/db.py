@@ -1,23 +1,56 @@
+"""
+SQLAlchemy storage backend for MoodTunes.
+
+Mirrors the MongoDB models in mongo_db.py (same method names, same
+dict-shaped documents with a string "_id") so routes can run against
+either backend; see storage.py. SQLite databases run in WAL mode.
+"""
 import json
 import os
+import threading
+from collections import defaultdict
 from contextlib import contextmanager
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, Float, Integer, String, Text, create_engine
+from sqlalchemy import (
+    Column, DateTime, Float, Index, Integer, String, Text, UniqueConstraint,
+    and_, create_engine, event, func, inspect, insert, or_, select, text,
+)
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import declarative_base, sessionmaker
 
+from passwords import hasher
+
 DATABASE_URL = os.environ.get("DATABASE_URL", f"sqlite:///{os.path.abspath('moodtunes.db')}")
 connect_args = {}
 if DATABASE_URL.startswith("sqlite"):
     connect_args["check_same_thread"] = False
 
 engine = create_engine(DATABASE_URL, connect_args=connect_args, future=True)
-SessionLocal = sessionmaker(bind=engine, future=True)
+SessionLocal = sessionmaker(bind=engine, future=True, expire_on_commit=False)
 Base = declarative_base()
 
+# Errors worth retrying (e.g. "database is locked" under concurrent writers)
+TRANSIENT_ERRORS = (OperationalError,)
+
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers proceed while the write-behind flusher commits
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
 
 class MoodRecord(Base):
     __tablename__ = "mood_records"
+    __table_args__ = (
+        Index("ix_mood_records_email_created", "email", "created_at", "id"),
+        Index("ix_mood_records_created", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String(255), nullable=True)
@@ -28,15 +61,96 @@ class MoodRecord(Base):
     detected_emotion = Column(String(64), nullable=False)
     confidence = Column(Float, nullable=True)
     spotify_tracks = Column(Text, nullable=True)
+    image_ref = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class UserPreference(Base):
+    __tablename__ = "user_preferences"
+
+    id = Column(Integer, primary_key=True)
+    email = Column(String(255), nullable=False, unique=True)
+    name = Column(String(255), nullable=True)
+    preferred_language = Column(String(64), nullable=True)
+    preferred_region = Column(String(64), nullable=True)
+    spotify_token = Column(Text, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class User(Base):
+    __tablename__ = "users"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(255), nullable=True)
+    email = Column(String(255), nullable=False, unique=True)
+    password_hash = Column(String(255), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class MoodRollup(Base):
+    """Per-emotion counts per (scope, email, granularity, period); email is "" for global"""
+    __tablename__ = "mood_rollups"
+    __table_args__ = (
+        UniqueConstraint("scope", "email", "granularity", "period", "emotion", name="uq_mood_rollups_key"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    scope = Column(String(16), nullable=False)
+    email = Column(String(255), nullable=False, default="")
+    granularity = Column(String(8), nullable=False)
+    period = Column(DateTime, nullable=False)
+    emotion = Column(String(64), nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    confidence_sum = Column(Float, nullable=False, default=0.0)
+    confidence_n = Column(Integer, nullable=False, default=0)
+
+
+def _add_missing_columns():
+    """Add nullable columns introduced after a table was first created (e.g. image_ref)."""
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(engine.dialect)
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+
+def _create_missing_indexes():
+    """create_all() skips existing tables, so indexes added later are created here."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+_tables_ready = False
+_tables_lock = threading.Lock()
+
+
+def create_tables():
+    """Create missing tables and columns once per process; repositories call this on first use."""
+    global _tables_ready
+    if _tables_ready:
+        return
+    with _tables_lock:
+        if not _tables_ready:
+            Base.metadata.create_all(bind=engine)
+            _add_missing_columns()
+            _tables_ready = True
 
 
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    create_tables()
+    _create_missing_indexes()
 
 
 @contextmanager
 def session_scope():
+    create_tables()
     session = SessionLocal()
     try:
         yield session
@@ -48,32 +162,484 @@ def session_scope():
         session.close()
 
 
+def _loads(value, default=None):
+    if value is None:
+        return default
+    try:
+        return json.loads(value)
+    except ValueError:
+        return default
+
+
+def _record_to_dict(row):
+    return {
+        "_id": str(row.id),
+        "email": row.email,
+        "name": row.name,
+        "selected_mood": row.selected_mood,
+        "region": row.region,
+        "language": row.language,
+        "detected_emotion": row.detected_emotion,
+        "confidence": row.confidence,
+        "spotify_tracks": _loads(row.spotify_tracks, []),
+        "image_ref": _loads(row.image_ref),
+        "created_at": row.created_at,
+    }
+
+
+def _record_to_row(document):
+    return {
+        "email": document.get("email"),
+        "name": document.get("name"),
+        "selected_mood": document.get("selected_mood"),
+        "region": document.get("region"),
+        "language": document.get("language"),
+        "detected_emotion": document["detected_emotion"],
+        "confidence": document.get("confidence"),
+        "spotify_tracks": json.dumps(document.get("spotify_tracks") or [], default=str),
+        "image_ref": json.dumps(document["image_ref"]) if document.get("image_ref") else None,
+        "created_at": document.get("created_at") or datetime.utcnow(),
+    }
+
+
+class MoodRecordRepository:
+    """SQL counterpart of mongo_db.MoodRecord"""
+
+    def __init__(self, rollups=None):
+        self.rollups = rollups
+
+    def ensure_indexes(self):
+        """Indexes are declared on the table and created by init_db()"""
+
+    @staticmethod
+    def build(email=None, name=None, selected_mood=None, region=None,
+              language=None, detected_emotion=None, confidence=None,
+              spotify_tracks=None, image_ref=None):
+        """Build a mood record document without writing it"""
+        if detected_emotion is None:
+            raise ValueError("detected_emotion is required")
+
+        return {
+            "email": email,
+            "name": name,
+            "selected_mood": selected_mood,
+            "region": region,
+            "language": language,
+            "detected_emotion": detected_emotion,
+            "confidence": confidence,
+            "spotify_tracks": spotify_tracks or [],
+            "image_ref": image_ref,
+            "created_at": datetime.utcnow()
+        }
+
+    def create(self, **fields):
+        """Create a new mood record; image_ref points into the image store"""
+        record = self.build(**fields)
+        with session_scope() as session:
+            row = MoodRecord(**_record_to_row(record))
+            session.add(row)
+            session.flush()
+            record["_id"] = str(row.id)
+            if self.rollups:
+                self.rollups.record([record], session=session)
+        return record
+
+    def create_many(self, records):
+        """Insert documents from build() as one executemany in one transaction"""
+        if not records:
+            return 0
+        with session_scope() as session:
+            session.execute(insert(MoodRecord), [_record_to_row(record) for record in records])
+            if self.rollups:
+                self.rollups.record(records, session=session)
+        return len(records)
+
+    @staticmethod
+    def make_cursor(record):
+        """Keyset cursor "<created_at ISO>,<id>" for the page after ``record``"""
+        return f"{record['created_at'].isoformat()},{record['_id']}"
+
+    @staticmethod
+    def parse_cursor(cursor):
+        """Parse a make_cursor() string; raises ValueError when malformed"""
+        created_at, _, record_id = cursor.rpartition(",")
+        try:
+            return datetime.fromisoformat(created_at), int(record_id)
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    def _find_page(self, email, limit, before):
+        query = select(MoodRecord)
+        if email is not None:
+            query = query.where(MoodRecord.email == email)
+        if before:
+            created_at, record_id = self.parse_cursor(before)
+            query = query.where(or_(
+                MoodRecord.created_at < created_at,
+                and_(MoodRecord.created_at == created_at, MoodRecord.id < record_id),
+            ))
+        query = query.order_by(MoodRecord.created_at.desc(), MoodRecord.id.desc()).limit(limit)
+        with session_scope() as session:
+            records = [_record_to_dict(row) for row in session.scalars(query)]
+        next_before = self.make_cursor(records[-1]) if len(records) == limit else None
+        return records, next_before
+
+    def find_page_by_email(self, email, limit=10, include_images=False, before=None):
+        """Page of mood records by email, newest first, plus the next cursor"""
+        return self._find_page(email, limit, before)
+
+    def find_page(self, limit=10, include_images=False, before=None):
+        """Page of all mood records, newest first, plus the next cursor"""
+        return self._find_page(None, limit, before)
+
+    def find_by_email(self, email, limit=10, include_images=False):
+        """Find mood records by email"""
+        return self.find_page_by_email(email, limit=limit)[0]
+
+    def find_all(self, limit=10, include_images=False):
+        """Find all mood records"""
+        return self.find_page(limit=limit)[0]
+
+    def find_by_id(self, record_id):
+        """Find a mood record by ID"""
+        try:
+            record_id = int(record_id)
+        except (TypeError, ValueError):
+            return None
+        with session_scope() as session:
+            row = session.get(MoodRecord, record_id)
+            return _record_to_dict(row) if row else None
+
+    def update_by_id(self, record_id, update_data):
+        """Update a mood record"""
+        row_data = {key: value for key, value in update_data.items() if key in MoodRecord.__table__.columns}
+        for key in ("spotify_tracks", "image_ref"):
+            if key in row_data and not isinstance(row_data[key], str):
+                row_data[key] = json.dumps(row_data[key], default=str)
+        try:
+            with session_scope() as session:
+                row = session.get(MoodRecord, int(record_id))
+                if row is None:
+                    return False
+                for key, value in row_data.items():
+                    setattr(row, key, value)
+                return True
+        except (TypeError, ValueError):
+            return False
+
+    def delete_by_id(self, record_id):
+        """Delete a mood record"""
+        try:
+            with session_scope() as session:
+                row = session.get(MoodRecord, int(record_id))
+                if row is None:
+                    return False
+                session.delete(row)
+                return True
+        except (TypeError, ValueError):
+            return False
+
+
+class UserPreferenceRepository:
+    """SQL counterpart of mongo_db.UserPreference"""
+
+    def ensure_indexes(self):
+        """Indexes are declared on the table and created by init_db()"""
+
+    @staticmethod
+    def build(email, name=None, preferred_language=None,
+              preferred_region=None, spotify_token=None):
+        """Build the document for a preferences upsert"""
+        if email is None:
+            raise ValueError("email is required")
+
+        return {
+            "email": email,
+            "name": name,
+            "preferred_language": preferred_language,
+            "preferred_region": preferred_region,
+            "spotify_token": spotify_token,
+            "updated_at": datetime.utcnow()
+        }
+
+    def _upsert(self, session, document):
+        row = session.scalars(select(UserPreference).where(UserPreference.email == document["email"])).first()
+        if row is None:
+            session.add(UserPreference(**document))
+            return
+        for key, value in document.items():
+            setattr(row, key, value)
+
+    def create_or_update(self, email, **fields):
+        """Create or update user preferences"""
+        with session_scope() as session:
+            self._upsert(session, self.build(email, **fields))
+        return True
+
+    def bulk_upsert(self, documents):
+        """Apply build() documents in order within one transaction"""
+        with session_scope() as session:
+            for document in documents:
+                self._upsert(session, document)
+                session.flush()
+        return len(documents)
+
+    def find_by_email(self, email):
+        """Find user preferences by email"""
+        with session_scope() as session:
+            row = session.scalars(select(UserPreference).where(UserPreference.email == email)).first()
+            if row is None:
+                return None
+            return {
+                "_id": str(row.id),
+                "email": row.email,
+                "name": row.name,
+                "preferred_language": row.preferred_language,
+                "preferred_region": row.preferred_region,
+                "spotify_token": row.spotify_token,
+                "updated_at": row.updated_at,
+            }
+
+    def update_spotify_token(self, email, spotify_token):
+        """Update Spotify token for user"""
+        with session_scope() as session:
+            row = session.scalars(select(UserPreference).where(UserPreference.email == email)).first()
+            if row is None:
+                return False
+            row.spotify_token = spotify_token
+            return True
+
+
+class UserRepository:
+    """SQL counterpart of mongo_db.UserModel"""
+
+    def ensure_indexes(self):
+        """Indexes are declared on the table and created by init_db()"""
+
+    @staticmethod
+    def _to_dict(row, with_hash=False):
+        user = {
+            "_id": str(row.id),
+            "name": row.name,
+            "email": row.email,
+            "created_at": row.created_at,
+            "updated_at": row.updated_at,
+        }
+        if with_hash:
+            user["password_hash"] = row.password_hash
+        return user
+
+    def create_user(self, name, email, password):
+        if not email or not password:
+            raise ValueError("email and password are required")
+
+        with session_scope() as session:
+            row = User(name=name, email=email, password_hash=hasher.hash(password))
+            session.add(row)
+            session.flush()
+            return self._to_dict(row)
+
+    def find_by_email(self, email):
+        with session_scope() as session:
+            row = session.scalars(select(User).where(User.email == email)).first()
+            return self._to_dict(row, with_hash=True) if row else None
+
+    def verify_password(self, email, password):
+        user = self.find_by_email(email)
+        if not user or not user.get("password_hash"):
+            return False, None
+        ok, needs_rehash = hasher.verify(user["password_hash"], password)
+        if not ok:
+            return False, None
+        if needs_rehash:
+            # Stored with older hashing parameters: upgrade transparently
+            with session_scope() as session:
+                row = session.get(User, int(user["_id"]))
+                row.password_hash = hasher.hash(password)
+                row.updated_at = datetime.utcnow()
+        user.pop("password_hash")
+        return True, user
+
+
+class MoodRollupRepository:
+    """SQL counterpart of mongo_db.MoodRollup, one row per emotion per period"""
+
+    GRANULARITIES = ("day", "hour")
+
+    def ensure_indexes(self):
+        """Indexes are declared on the table and created by init_db()"""
+
+    @staticmethod
+    def _period(created_at, granularity):
+        if granularity == "day":
+            return created_at.replace(hour=0, minute=0, second=0, microsecond=0)
+        return created_at.replace(minute=0, second=0, microsecond=0)
+
+    def record(self, records, session=None):
+        """Fold mood record documents into the rollups"""
+        increments = defaultdict(lambda: [0, 0.0, 0])
+        for record in records:
+            emotion = record.get("detected_emotion")
+            created_at = record.get("created_at")
+            if not emotion or created_at is None:
+                continue
+            scopes = [("global", "")]
+            if record.get("email"):
+                scopes.append(("user", record["email"]))
+            for scope, email in scopes:
+                for granularity in self.GRANULARITIES:
+                    inc = increments[(scope, email, granularity, self._period(created_at, granularity), emotion)]
+                    inc[0] += 1
+                    if record.get("confidence") is not None:
+                        inc[1] += record["confidence"]
+                        inc[2] += 1
+        if not increments:
+            return 0
+        if session is None:
+            with session_scope() as own_session:
+                return self._apply(own_session, increments)
+        return self._apply(session, increments)
+
+    def _apply(self, session, increments):
+        rows = [
+            {"scope": scope, "email": email, "granularity": granularity, "period": period,
+             "emotion": emotion, "count": count, "confidence_sum": conf_sum, "confidence_n": conf_n}
+            for (scope, email, granularity, period, emotion), (count, conf_sum, conf_n) in increments.items()
+        ]
+        dialect = session.get_bind().dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            if dialect == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert as upsert
+            else:
+                from sqlalchemy.dialects.postgresql import insert as upsert
+            statement = upsert(MoodRollup)
+            statement = statement.on_conflict_do_update(
+                index_elements=["scope", "email", "granularity", "period", "emotion"],
+                set_={
+                    "count": MoodRollup.count + statement.excluded.count,
+                    "confidence_sum": MoodRollup.confidence_sum + statement.excluded.confidence_sum,
+                    "confidence_n": MoodRollup.confidence_n + statement.excluded.confidence_n,
+                },
+            )
+            session.execute(statement, rows)
+            return len(rows)
+        for row_data in rows:
+            row = session.scalars(select(MoodRollup).filter_by(
+                scope=row_data["scope"], email=row_data["email"], granularity=row_data["granularity"],
+                period=row_data["period"], emotion=row_data["emotion"],
+            )).first()
+            if row is None:
+                session.add(MoodRollup(**row_data))
+            else:
+                row.count += row_data["count"]
+                row.confidence_sum += row_data["confidence_sum"]
+                row.confidence_n += row_data["confidence_n"]
+        return len(rows)
+
+    def summary(self, email=None, since=None, granularity="day"):
+        """Emotion distribution, average confidence and time series from the rollups"""
+        query = select(
+            MoodRollup.period, MoodRollup.emotion,
+            func.sum(MoodRollup.count), func.sum(MoodRollup.confidence_sum), func.sum(MoodRollup.confidence_n),
+        ).where(
+            MoodRollup.scope == ("user" if email else "global"),
+            MoodRollup.email == (email or ""),
+            MoodRollup.granularity == granularity,
+        )
+        if since is not None:
+            query = query.where(MoodRollup.period >= self._period(since, granularity))
+        query = query.group_by(MoodRollup.period, MoodRollup.emotion).order_by(MoodRollup.period)
+
+        series, distribution = {}, defaultdict(int)
+        total, conf_sum_total, conf_n_total = 0, 0.0, 0
+        with session_scope() as session:
+            for period, emotion, count, conf_sum, conf_n in session.execute(query):
+                bucket = series.setdefault(period, {"counts": {}, "total": 0, "sum": 0.0, "n": 0})
+                bucket["counts"][emotion] = int(count)
+                bucket["total"] += int(count)
+                bucket["sum"] += conf_sum or 0.0
+                bucket["n"] += int(conf_n or 0)
+                distribution[emotion] += int(count)
+                total += int(count)
+                conf_sum_total += conf_sum or 0.0
+                conf_n_total += int(conf_n or 0)
+        return {
+            "total": total,
+            "avg_confidence": (conf_sum_total / conf_n_total) if conf_n_total else None,
+            "distribution": {
+                emotion: {"count": count, "share": count / total}
+                for emotion, count in sorted(distribution.items(), key=lambda item: -item[1])
+            },
+            "series": [
+                {
+                    "period": period.isoformat(),
+                    "total": bucket["total"],
+                    "counts": bucket["counts"],
+                    "avg_confidence": (bucket["sum"] / bucket["n"]) if bucket["n"] else None,
+                }
+                for period, bucket in series.items()
+            ],
+        }
+
+    def rebuild(self, batch_size=1000):
+        """Recompute all rollups from mood_records (backfill for existing data)"""
+        count = 0
+        with session_scope() as session:
+            session.query(MoodRollup).delete()
+            batch = []
+            rows = session.execute(
+                select(MoodRecord.email, MoodRecord.detected_emotion, MoodRecord.confidence, MoodRecord.created_at)
+                .execution_options(yield_per=batch_size)
+            )
+            for email, emotion, confidence, created_at in rows:
+                batch.append({"email": email, "detected_emotion": emotion,
+                              "confidence": confidence, "created_at": created_at})
+                if len(batch) >= batch_size:
+                    self.record(batch, session=session)
+                    count += len(batch)
+                    batch = []
+            self.record(batch, session=session)
+        return count + len(batch)
+
+
+mood_rollup = MoodRollupRepository()
+mood_record = MoodRecordRepository(mood_rollup)
+user_preference = UserPreferenceRepository()
+users = UserRepository()
+
+
+def ensure_indexes():
+    """Create indexes added after their table existed (tables are created lazily)"""
+    init_db()
+
+
+def check_db_connection():
+    """SQL storage is local; report whether the engine answers a trivial query"""
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        return True
+    except Exception:
+        return False
+
+
+def report_db_error(exc=None):
+    """SQL connections are checked per query; nothing to record"""
+
+
+def db_health():
+    return {"state": "closed" if check_db_connection() else "open"}
+
+
 def save_mood_record(email=None, name=None, selected_mood=None, region=None, language=None,
                      detected_emotion=None, confidence=None, spotify_tracks=None):
-    if detected_emotion is None:
-        raise ValueError("detected_emotion is required")
-
-    payload = json.dumps(spotify_tracks or [], default=str)
-    with session_scope() as session:
-        record = MoodRecord(
-            email=email,
-            name=name,
-            selected_mood=selected_mood,
-            region=region,
-            language=language,
-            detected_emotion=detected_emotion,
-            confidence=confidence,
-            spotify_tracks=payload,
-        )
-        session.add(record)
-        session.flush()
-        return record
+    return mood_record.create(
+        email=email, name=name, selected_mood=selected_mood, region=region, language=language,
+        detected_emotion=detected_emotion, confidence=confidence, spotify_tracks=spotify_tracks,
+    )
 
 
 def fetch_mood_records(email=None, limit=10):
-    with session_scope() as session:
-        query = session.query(MoodRecord).order_by(MoodRecord.created_at.desc())
-        if email:
-            query = query.filter(MoodRecord.email == email)
-        return query.limit(limit).all()
-
+    if email:
+        return mood_record.find_by_email(email, limit=limit)
+    return mood_record.find_all(limit=limit)
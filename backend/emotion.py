@@ -1,52 +1,266 @@
+import logging
 import os
+import threading
 
 import cv2
 import numpy as np
-from keras.models import load_model
-from keras.preprocessing.image import img_to_array
+
+import config
+from inference import BatchScheduler, load_predictor
+from tracking import FaceTracker
+
+logger = logging.getLogger(__name__)
 
 EMOTION_LABELS = ["angry", "disgust", "fear", "happy", "neutral", "sad", "surprise"]
+ROI_SIZE = 48
 
 _model = None
-_face_cascade = None
-_model_path = os.path.join(os.path.dirname(__file__), "model.h5")
+_face_detector = None
+_scheduler = None
+_scheduler_lock = threading.Lock()
+_model_dir = os.path.dirname(__file__)
+_model_paths = {
+    "keras": os.path.join(_model_dir, "model.h5"),
+    "function": os.path.join(_model_dir, "model.h5"),
+    "tflite": os.path.join(_model_dir, "model.tflite"),
+    "tflite_int8": os.path.join(_model_dir, "model_int8.tflite"),
+    "onnx": os.path.join(_model_dir, "model.onnx"),
+}
 _cascade_path = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+# Not committed; fetch it from YUNET_MODEL_URL (see README_SETUP.md)
+_yunet_path = os.path.join(_model_dir, "models", "face_detection_yunet_2023mar.onnx")
+YUNET_MODEL_URL = (
+    "https://github.com/opencv/opencv_zoo/raw/main/models/face_detection_yunet/face_detection_yunet_2023mar.onnx"
+)
 
 
-def _load_resources():
-    global _model, _face_cascade
-    if _face_cascade is None:
-        _face_cascade = cv2.CascadeClassifier(_cascade_path)
-        if _face_cascade.empty():
+class HaarDetector:
+    """OpenCV Haar cascade; the original detector and the default."""
+
+    def __init__(self, cascade_path=_cascade_path):
+        self.cascade = cv2.CascadeClassifier(cascade_path)
+        if self.cascade.empty():
             raise RuntimeError("Unable to load face detector.")
+
+    def detect(self, image, gray):
+        faces = self.cascade.detectMultiScale(gray, scaleFactor=1.3, minNeighbors=5)
+        return [tuple(int(v) for v in box) for box in faces]
+
+
+class YuNetDetector:
+    """OpenCV DNN YuNet detector, loaded from a local ONNX file."""
+
+    def __init__(self, model_path=_yunet_path, score_threshold=0.8):
+        if not os.path.isfile(model_path):
+            raise FileNotFoundError(f"YuNet face detector not found at {model_path}")
+        self.detector = cv2.FaceDetectorYN.create(model_path, "", (320, 320), score_threshold, 0.3, 5000)
+        # setInputSize mutates the detector, so calls are serialised
+        self._lock = threading.Lock()
+
+    def detect(self, image, gray):
+        height, width = image.shape[:2]
+        with self._lock:
+            self.detector.setInputSize((width, height))
+            _, faces = self.detector.detect(image)
+        if faces is None:
+            return []
+        boxes = []
+        for face in faces:
+            x, y, w, h = (int(round(v)) for v in face[:4])
+            x, y = max(0, x), max(0, y)
+            boxes.append((x, y, min(w, width - x), min(h, height - y)))
+        return boxes
+
+
+FACE_DETECTORS = {"haar": HaarDetector, "yunet": YuNetDetector}
+
+
+def create_face_detector(name):
+    """The named detector; yunet falls back to Haar (with a warning) when its model file is missing."""
+    if name not in FACE_DETECTORS:
+        raise RuntimeError(f"Unknown face detector {name!r}; expected one of {', '.join(FACE_DETECTORS)}")
+    if name == "yunet":
+        model_path = config.YUNET_MODEL_PATH or _yunet_path
+        if not os.path.isfile(model_path):
+            logger.warning(
+                "FACE_DETECTOR=yunet but %s is missing; using the Haar detector. Download it from %s",
+                model_path, YUNET_MODEL_URL,
+            )
+            return HaarDetector()
+        return YuNetDetector(model_path)
+    return FACE_DETECTORS[name]()
+
+
+def detect_faces(detector, image, gray, max_side=None):
+    """
+    Run ``detector`` on a copy of the image downscaled so its longest side is at
+    most ``max_side`` (0 or None disables), mapping boxes back to full resolution.
+    """
+    height, width = gray.shape[:2]
+    scale = 1.0
+    if max_side and max(height, width) > max_side:
+        scale = max_side / float(max(height, width))
+        size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    boxes = detector.detect(image, gray)
+    if scale == 1.0:
+        return boxes
+    return [tuple(int(round(v / scale)) for v in box) for box in boxes]
+
+
+def _load_resources():
+    global _model, _face_detector
+    if _face_detector is None:
+        _face_detector = create_face_detector(config.FACE_DETECTOR)
     if _model is None:
-        if not os.path.isfile(_model_path):
-            raise FileNotFoundError(f"Emotion model not found at {_model_path}")
-        _model = load_model(_model_path)
-    return _face_cascade, _model
+        model_path = config.EMOTION_MODEL_PATH or _model_paths.get(config.EMOTION_BACKEND, "")
+        if not os.path.isfile(model_path):
+            raise FileNotFoundError(f"Emotion model not found at {model_path}")
+        _model = load_predictor(config.EMOTION_BACKEND, model_path)
+    return _face_detector, _model
 
 
-def detect_emotion_from_image(image):
+def warm_up():
+    """Load the detector and model and run dummy batches so the first request is fast."""
+    face_detector, classifier = _load_resources()
+    blank = np.zeros((ROI_SIZE * 4, ROI_SIZE * 4, 3), dtype=np.uint8)
+    face_detector.detect(blank, cv2.cvtColor(blank, cv2.COLOR_BGR2GRAY))
+    for size in sorted({1, config.INFERENCE_BATCH_SIZE}):
+        classifier(np.zeros((size, ROI_SIZE, ROI_SIZE, 1), dtype=np.float32))
+    get_scheduler()
+
+
+def get_scheduler(create=True):
+    """
+    Return the shared micro-batching scheduler, or None when batching is
+    disabled (or, with create=False, not started yet).
+    """
+    global _scheduler
+    if not config.INFERENCE_BATCHING:
+        return None
+    if _scheduler is None and create:
+        with _scheduler_lock:
+            # Concurrent first requests must share one scheduler thread
+            if _scheduler is None:
+                _, classifier = _load_resources()
+                _scheduler = BatchScheduler(
+                    classifier,
+                    batch_size=config.INFERENCE_BATCH_SIZE,
+                    max_wait_ms=config.INFERENCE_MAX_WAIT_MS,
+                    result_timeout=config.INFERENCE_RESULT_TIMEOUT,
+                )
+    return _scheduler
+
+
+def _prepare_roi(gray, box):
+    """Crop, resize and normalise one face box into a 48x48x1 float32 array."""
+    x, y, w, h = box
+    roi = gray[y : y + h, x : x + w]
+    if roi.size == 0:
+        return None
+    roi = cv2.resize(roi, (ROI_SIZE, ROI_SIZE), interpolation=cv2.INTER_AREA)
+    return (roi.astype(np.float32) / 255.0)[..., np.newaxis]
+
+
+def _predict_batch(classifier, rois):
+    """Run one forward pass over a stacked (N, 48, 48, 1) batch of face ROIs."""
+    scheduler = get_scheduler()
+    if scheduler is not None:
+        return scheduler.predict(rois)
+    batch = np.stack(rois).astype(np.float32, copy=False)
+    return np.asarray(classifier(batch))
+
+
+def create_tracker(detect_every=None):
+    """Return a FaceTracker for one video source that detects with the configured detector."""
+
+    def detect(image, gray):
+        face_detector, _ = _load_resources()
+        return detect_faces(face_detector, image, gray, max_side=config.FACE_DETECTOR_MAX_SIDE)
+
+    return FaceTracker(detect, detect_every=detect_every or config.TRACKER_DETECT_EVERY)
+
+
+def classify_faces(gray, boxes):
+    """
+    Classify the given face boxes of a grayscale frame in a single batch.
+
+    Returns a list of dicts with ``emotion``, ``confidence``, ``probabilities``
+    and ``box`` (x, y, w, h in image coordinates).
+    """
+    _, classifier = _load_resources()
+    kept, rois = [], []
+    for box in boxes:
+        roi = _prepare_roi(gray, box)
+        if roi is not None:
+            kept.append(box)
+            rois.append(roi)
+    if not rois:
+        raise ValueError("Unable to extract a face from the provided image.")
+
+    predictions = _predict_batch(classifier, rois)
+    results = []
+    for box, prediction in zip(kept, predictions):
+        label_index = int(np.argmax(prediction))
+        results.append(
+            {
+                "emotion": EMOTION_LABELS[label_index],
+                "confidence": float(prediction[label_index]),
+                "probabilities": [float(p) for p in prediction],
+                "box": list(box),
+            }
+        )
+    return results
+
+
+def classify_face_crops(crops):
+    """
+    Classify faces already cropped to 48x48 8-bit grayscale by the client,
+    skipping decoding and face detection. Results have ``box`` set to None.
+    """
+    _, classifier = _load_resources()
+    if not crops:
+        raise ValueError("No face data was supplied.")
+    rois = [(np.asarray(crop, dtype=np.float32) / 255.0).reshape(ROI_SIZE, ROI_SIZE, 1) for crop in crops]
+    predictions = _predict_batch(classifier, rois)
+    return [
+        {
+            "emotion": EMOTION_LABELS[int(np.argmax(prediction))],
+            "confidence": float(np.max(prediction)),
+            "probabilities": [float(p) for p in prediction],
+            "box": None,
+        }
+        for prediction in predictions
+    ]
+
+
+def detect_emotions_from_image(image, max_faces=None, tracker=None):
+    """
+    Detect every face in a BGR image and classify them in a single batch.
+
+    Faces are ordered largest first; ``max_faces`` caps how many are classified.
+    For video, pass a ``tracker`` from create_tracker() to follow faces between
+    periodic detections instead of detecting on every frame.
+    """
     if image is None:
         raise ValueError("No image data was supplied.")
-    face_cascade, classifier = _load_resources()
+    face_detector, _ = _load_resources()
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.3, minNeighbors=5)
+    if tracker is not None:
+        faces = tracker.update(image, gray)
+    else:
+        faces = detect_faces(face_detector, image, gray, max_side=config.FACE_DETECTOR_MAX_SIDE)
     if len(faces) == 0:
         raise ValueError("No face detected. Please retake the photo with your face centered.")
 
-    for (x, y, w, h) in faces:
-        roi = gray[y : y + h, x : x + w]
-        if roi.size == 0:
-            continue
-        roi = cv2.resize(roi, (48, 48), interpolation=cv2.INTER_AREA)
-        roi = roi.astype("float") / 255.0
-        roi = img_to_array(roi)
-        roi = np.expand_dims(roi, axis=0)
-        prediction = classifier.predict(roi)[0]
-        label_index = int(np.argmax(prediction))
-        label = EMOTION_LABELS[label_index]
-        confidence = float(np.max(prediction))
-        return label, confidence
+    faces = sorted(faces, key=lambda b: b[2] * b[3], reverse=True)
+    if max_faces is not None:
+        faces = faces[: max(1, int(max_faces))]
+    return classify_faces(gray, faces)
 
-    raise ValueError("Unable to extract a face from the provided image.")
+
+def detect_emotion_from_image(image):
+    """Return ``(label, confidence)`` for the most prominent face in the image."""
+    primary = detect_emotions_from_image(image, max_faces=1)[0]
+    return primary["emotion"], primary["confidence"]
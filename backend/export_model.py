@@ -0,0 +1,153 @@
+"""
+Export model.h5 to the compiled inference backends and check parity.
+
+    python export_model.py                  # writes model.tflite, model_int8.tflite and model.onnx
+    python export_model.py --formats tflite_int8 --calibration faces/
+    python export_model.py --check-only     # re-run the parity check
+
+The parity check feeds the same random batch of 48x48 faces through the Keras
+model and every exported backend, and fails if the probabilities differ by
+more than --atol or the top-1 labels disagree. The int8 model is quantized
+after training and is only expected to agree closely, so it is reported
+against --int8-agreement instead.
+
+Int8 calibration uses face crops from --calibration (a directory of photos);
+without it a fixed random set is used, which gives poorer quantization ranges.
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from inference import load_predictor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+KERAS_PATH = os.path.join(BASE_DIR, "model.h5")
+EXPORT_PATHS = {
+    "tflite": os.path.join(BASE_DIR, "model.tflite"),
+    "tflite_int8": os.path.join(BASE_DIR, "model_int8.tflite"),
+    "onnx": os.path.join(BASE_DIR, "model.onnx"),
+}
+
+
+def load_face_crops(directory, limit=256):
+    """Detect faces in every image under ``directory`` and return (N, 48, 48, 1) float32 crops."""
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    crops = []
+    for name in sorted(os.listdir(directory)):
+        image = cv2.imread(os.path.join(directory, name), cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            continue
+        for (x, y, w, h) in cascade.detectMultiScale(image, scaleFactor=1.3, minNeighbors=5):
+            roi = cv2.resize(image[y : y + h, x : x + w], (48, 48), interpolation=cv2.INTER_AREA)
+            crops.append((roi.astype(np.float32) / 255.0)[..., np.newaxis])
+            if len(crops) >= limit:
+                return np.stack(crops)
+    if not crops:
+        raise ValueError(f"No faces found in {directory}")
+    return np.stack(crops)
+
+
+def random_crops(count, seed=0):
+    return np.random.default_rng(seed).random((count, 48, 48, 1), dtype=np.float32)
+
+
+def export_tflite(model, path, calibration=None):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    with open(path, "wb") as fh:
+        fh.write(converter.convert())
+
+
+def export_tflite_int8(model, path, calibration):
+    """Post-training full-integer quantization, calibrated on ``calibration`` crops."""
+    import tensorflow as tf
+
+    def representative_dataset():
+        for crop in calibration:
+            yield [crop[np.newaxis]]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+    with open(path, "wb") as fh:
+        fh.write(converter.convert())
+
+
+def export_onnx(model, path, calibration=None):
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = (tf.TensorSpec((None, *model.input_shape[1:]), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, output_path=path)
+
+
+def time_per_face(predict, batch, repeats=20):
+    predict(batch)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        predict(batch)
+    return (time.perf_counter() - start) * 1000.0 / (repeats * len(batch))
+
+
+def check_parity(formats, batch, atol, int8_agreement):
+    reference_predict = load_predictor("keras", KERAS_PATH)
+    reference = np.asarray(reference_predict(batch))
+    print(f"keras       {time_per_face(reference_predict, batch):7.3f} ms/face")
+
+    ok = True
+    for backend, path in [("function", KERAS_PATH)] + [(f, EXPORT_PATHS[f]) for f in formats]:
+        if not os.path.isfile(path):
+            print(f"{backend:<11} missing {path}")
+            ok = False
+            continue
+        predict = load_predictor(backend, path)
+        output = np.asarray(predict(batch))
+        max_diff = float(np.max(np.abs(output - reference)))
+        agreement = float(np.mean(output.argmax(axis=1) == reference.argmax(axis=1)))
+        if backend == "tflite_int8":
+            passed = agreement >= int8_agreement
+        else:
+            passed = max_diff <= atol and agreement == 1.0
+        ok = ok and passed
+        print(
+            f"{backend:<11} {time_per_face(predict, batch):7.3f} ms/face  "
+            f"max|diff|={max_diff:.2e}  top-1 agreement={agreement:.1%}  {'OK' if passed else 'FAIL'}"
+        )
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--formats", nargs="+", choices=sorted(EXPORT_PATHS), default=sorted(EXPORT_PATHS))
+    parser.add_argument("--check-only", action="store_true", help="skip export, only compare outputs")
+    parser.add_argument("--samples", type=int, default=64)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    parser.add_argument("--int8-agreement", type=float, default=0.9, help="minimum int8 top-1 agreement")
+    parser.add_argument("--calibration", help="directory of face photos for int8 calibration and parity")
+    args = parser.parse_args(argv)
+
+    crops = load_face_crops(args.calibration) if args.calibration else random_crops(args.samples)
+
+    if not args.check_only:
+        from keras.models import load_model
+
+        model = load_model(KERAS_PATH, compile=False)
+        exporters = {"tflite": export_tflite, "tflite_int8": export_tflite_int8, "onnx": export_onnx}
+        for fmt in args.formats:
+            exporters[fmt](model, EXPORT_PATHS[fmt], calibration=crops)
+            print(f"Exported {fmt} model to {EXPORT_PATHS[fmt]}")
+
+    ok = check_parity(args.formats, crops[: args.samples], args.atol, args.int8_agreement)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Content-addressed storage for uploaded face images.
+
+Mood records keep only a small reference ({"store", "key", ...}) instead of
+the image itself. Images are optionally downscaled to a thumbnail, encoded
+as JPEG and keyed by the SHA-256 of the encoded bytes, so identical uploads
+are stored once. Backends: a local blob directory or MongoDB GridFS.
+"""
+import hashlib
+import os
+import threading
+
+import cv2
+
+import config
+
+
+def encode_thumbnail(image, max_side=256, quality=85):
+    """Downscale a BGR image so its longest side is at most ``max_side`` (0 keeps it) and JPEG-encode it."""
+    height, width = image.shape[:2]
+    if max_side and max(height, width) > max_side:
+        scale = max_side / float(max(height, width))
+        image = cv2.resize(
+            image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA
+        )
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Unable to encode image")
+    return encoded.tobytes()
+
+
+class LocalBlobStore:
+    """Blobs under ``root/ab/abcdef...`` keyed by content hash."""
+
+    name = "local"
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        if len(key) != 64 or not all(c in "0123456789abcdef" for c in key):
+            raise ValueError("Invalid image key")
+        return os.path.join(self.root, key[:2], key)
+
+    def put(self, data, content_type="image/jpeg"):
+        key = hashlib.sha256(data).hexdigest()
+        path = self._path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp, path)
+        return key
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as fh:
+                return fh.read(), "image/jpeg"
+        except (OSError, ValueError):
+            return None, None
+
+
+class GridFSStore:
+    """Blobs in a GridFS bucket, with the content hash as the file _id."""
+
+    name = "gridfs"
+
+    def __init__(self, database, bucket="mood_images"):
+        import gridfs
+
+        self.fs = gridfs.GridFS(database, collection=bucket)
+
+    def put(self, data, content_type="image/jpeg"):
+        key = hashlib.sha256(data).hexdigest()
+        if not self.fs.exists(key):
+            try:
+                self.fs.put(data, _id=key, content_type=content_type)
+            except Exception:
+                # A concurrent upload of the same content already stored it
+                if not self.fs.exists(key):
+                    raise
+        return key
+
+    def get(self, key):
+        grid_out = self.fs.find_one({"_id": key})
+        if grid_out is None:
+            return None, None
+        return grid_out.read(), getattr(grid_out, "content_type", None) or "image/jpeg"
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_image_store():
+    """Return the configured store (IMAGE_STORE=local|gridfs|none), or None when disabled.
+
+    GridFS is only available with the MongoDB storage backend."""
+    global _store
+    if config.IMAGE_STORE == "none":
+        return None
+    with _store_lock:
+        if _store is None:
+            if config.IMAGE_STORE == "gridfs":
+                if config.STORAGE_BACKEND != "mongo":
+                    return None
+                from mongo_db import db
+
+                if db is None:
+                    return None
+                _store = GridFSStore(db)
+            else:
+                _store = LocalBlobStore(config.IMAGE_STORE_DIR)
+        return _store
+
+
+def save_image(image):
+    """Store a decoded BGR image as a thumbnail; returns the record reference or None."""
+    store = get_image_store()
+    if store is None or image is None:
+        return None
+    data = encode_thumbnail(image, max_side=config.IMAGE_STORE_MAX_SIDE)
+    return {"store": store.name, "key": store.put(data), "content_type": "image/jpeg", "bytes": len(data)}
@@ -0,0 +1,212 @@
+"""
+Inference backends and cross-request micro-batching for the emotion classifier.
+
+Each backend loader returns a predictor: a callable taking a float32
+(N, 48, 48, 1) batch and returning an (N, 7) probability array.
+
+Concurrent /api/detect requests submit their face ROIs to a shared queue; a
+single worker thread flushes the queue as one model call once either
+``batch_size`` faces are pending or the oldest request has waited
+``max_wait_ms``. Each caller gets a Future resolving to its own predictions;
+a failed batch fails every Future in it, and predict() waits at most
+``result_timeout`` seconds.
+"""
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+BACKENDS = ("keras", "function", "tflite", "tflite_int8", "onnx")
+
+
+def _load_keras(model_path):
+    from keras.models import load_model
+
+    model = load_model(model_path, compile=False)
+    return lambda batch: model.predict(batch, verbose=0)
+
+
+def _load_function(model_path):
+    """Call the Keras graph directly through a traced tf.function, skipping predict()."""
+    import tensorflow as tf
+    from keras.models import load_model
+
+    model = load_model(model_path, compile=False)
+    forward = tf.function(
+        lambda batch: model(batch, training=False),
+        input_signature=[tf.TensorSpec([None, *model.input_shape[1:]], tf.float32)],
+    )
+    return lambda batch: forward(batch).numpy()
+
+
+def _load_tflite(model_path):
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+
+        Interpreter = tf.lite.Interpreter
+
+    interpreter = Interpreter(model_path=model_path)
+    input_details = interpreter.get_input_details()[0]
+    output_details = interpreter.get_output_details()[0]
+    input_index, output_index = input_details["index"], output_details["index"]
+    # Fully int8-quantized models take and return integer tensors.
+    input_dtype = input_details["dtype"]
+    input_scale, input_zero = input_details["quantization"]
+    output_scale, output_zero = output_details["quantization"]
+    interpreter.allocate_tensors()
+    lock = threading.Lock()
+    state = {"batch": None}
+
+    def predict(batch):
+        with lock:  # the interpreter holds mutable tensor buffers
+            if state["batch"] != len(batch):
+                interpreter.resize_tensor_input(input_index, batch.shape)
+                interpreter.allocate_tensors()
+                state["batch"] = len(batch)
+            if input_dtype != np.float32:
+                info = np.iinfo(input_dtype)
+                batch = np.clip(np.round(batch / input_scale + input_zero), info.min, info.max).astype(input_dtype)
+            interpreter.set_tensor(input_index, batch)
+            interpreter.invoke()
+            output = interpreter.get_tensor(output_index)
+            if output.dtype != np.float32:
+                return (output.astype(np.float32) - output_zero) * output_scale
+            return output.copy()
+
+    return predict
+
+
+def _load_onnx(model_path):
+    import onnxruntime as ort
+
+    session = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+    return lambda batch: session.run(None, {input_name: batch})[0]
+
+
+def load_predictor(backend, model_path):
+    """Load ``model_path`` with the named backend and return its predictor."""
+    loaders = {
+        "keras": _load_keras,
+        "function": _load_function,
+        "tflite": _load_tflite,
+        "tflite_int8": _load_tflite,
+        "onnx": _load_onnx,
+    }
+    if backend not in loaders:
+        raise RuntimeError(f"Unknown inference backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+    return loaders[backend](model_path)
+
+
+class BatchScheduler:
+    """Collects ROIs from many threads and runs them through ``predict_fn`` in batches."""
+
+    def __init__(self, predict_fn, batch_size=16, max_wait_ms=5.0, result_timeout=30.0):
+        self.predict_fn = predict_fn
+        self.batch_size = max(1, int(batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.result_timeout = result_timeout
+        self._pending = deque()
+        self._pending_faces = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._batches = 0
+        self._faces = 0
+        self._sizes = Counter()
+        self._worker = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, rois):
+        """Queue a list of (48, 48, 1) ROIs; returns a Future of an (N, classes) array."""
+        future = Future()
+        if not rois:
+            future.set_result(np.empty((0, 0), dtype=np.float32))
+            return future
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Inference scheduler is shut down.")
+            self._pending.append((rois, future, time.monotonic()))
+            self._pending_faces += len(rois)
+            self._cond.notify()
+        return future
+
+    def predict(self, rois, timeout=None):
+        """
+        Blocking helper: submit and wait for this caller's predictions, at most
+        ``timeout`` seconds (default ``result_timeout``).
+        """
+        return self.submit(rois).result(timeout=self.result_timeout if timeout is None else timeout)
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if wait:
+            self._worker.join()
+
+    def stats(self):
+        """Achieved batch sizes, for tuning batch size against tail latency."""
+        with self._cond:
+            return {
+                "batch_size": self.batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": self._batches,
+                "faces": self._faces,
+                "mean_batch_size": (self._faces / self._batches) if self._batches else 0.0,
+                "queue_depth": self._pending_faces,
+                "batch_size_histogram": dict(sorted(self._sizes.items())),
+            }
+
+    def _take_batch(self):
+        """Wait for a size-or-deadline trigger and pop the requests to run."""
+        with self._cond:
+            while True:
+                if self._pending:
+                    if self._closed or self._pending_faces >= self.batch_size:
+                        break
+                    remaining = self._pending[0][2] + self.max_wait - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                elif self._closed:
+                    return None
+                else:
+                    self._cond.wait()
+
+            taken, count = [], 0
+            # Always take at least one request, even if it alone exceeds batch_size.
+            while self._pending and (not taken or count + len(self._pending[0][0]) <= self.batch_size):
+                rois, future, _ = self._pending.popleft()
+                taken.append((rois, future))
+                count += len(rois)
+            self._pending_faces -= count
+            return taken
+
+    def _run(self):
+        while True:
+            taken = self._take_batch()
+            if taken is None:
+                return
+            live = [(rois, future) for rois, future in taken if future.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            try:
+                # A malformed ROI must fail its batch, not kill the worker thread
+                batch = np.stack([roi for rois, _ in live for roi in rois]).astype(np.float32, copy=False)
+                predictions = np.asarray(self.predict_fn(batch))
+            except Exception as exc:  # propagate to every waiting caller
+                for _, future in live:
+                    future.set_exception(exc)
+                continue
+            with self._cond:
+                self._batches += 1
+                self._faces += len(batch)
+                self._sizes[len(batch)] += 1
+            offset = 0
+            for rois, future in live:
+                future.set_result(predictions[offset : offset + len(rois)])
+                offset += len(rois)
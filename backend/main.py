@@ -1,46 +1,48 @@
-from keras.models import load_model
-from time import sleep
-from keras.preprocessing.image import img_to_array
-from keras.preprocessing import image
+import time
+
 import cv2
-import numpy as np
 
-face_classifier = cv2.CascadeClassifier(r"C:\Users\thaku\Desktop\Face_recognition\haarcascade_frontalface_default.xml")
-classifier =load_model(r'C:\Users\thaku\Downloads\model.h5')
+from emotion import EMOTION_LABELS, create_tracker, detect_emotions_from_image
+from smoothing import create_smoother
 
-emotion_labels = ['Angry','Disgust','Fear','Happy','Neutral', 'Sad', 'Surprise']
+# Standalone webcam demo: the face detector runs every TRACKER_DETECT_EVERY
+# frames and faces are tracked in between, which keeps the loop fast on a CPU.
+# The largest face's label is smoothed over time so it does not flicker.
+tracker = create_tracker()
+smoother = create_smoother(EMOTION_LABELS)
 
 cap = cv2.VideoCapture(0)
-
-
+fps = 0.0
+last = time.perf_counter()
 
 while True:
-    _, frame = cap.read()
-    labels = []
-    gray = cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY)
-    faces = face_classifier.detectMultiScale(gray)
-
-    for (x,y,w,h) in faces:
-        cv2.rectangle(frame,(x,y),(x+w,y+h),(0,255,255),2)
-        roi_gray = gray[y:y+h,x:x+w]
-        roi_gray = cv2.resize(roi_gray,(48,48),interpolation=cv2.INTER_AREA)
-
-
-
-        if np.sum([roi_gray])!=0:
-            roi = roi_gray.astype('float')/255.0
-            roi = img_to_array(roi)
-            roi = np.expand_dims(roi,axis=0)
-
-            prediction = classifier.predict(roi)[0]
-            label=emotion_labels[prediction.argmax()]
-            label_position = (x,y)
-            cv2.putText(frame,label,label_position,cv2.FONT_HERSHEY_SIMPLEX,1,(0,255,0),2)
-        else:
-            cv2.putText(frame,'No Faces',(30,80),cv2.FONT_HERSHEY_SIMPLEX,1,(0,255,0),2)
-    cv2.imshow('Emotion Detector',frame)
+    ok, frame = cap.read()
+    if not ok:
+        break
+
+    try:
+        faces = detect_emotions_from_image(frame, tracker=tracker)
+    except ValueError:
+        tracker.reset()
+        faces = []
+
+    if faces:
+        faces[0]["emotion"] = smoother.update(faces[0]["probabilities"])["emotion"]
+    for face in faces:
+        x, y, w, h = face["box"]
+        cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 255), 2)
+        cv2.putText(frame, face["emotion"].capitalize(), (x, y), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+    if not faces:
+        cv2.putText(frame, 'No Faces', (30, 80), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+
+    now = time.perf_counter()
+    fps = 0.9 * fps + 0.1 / max(now - last, 1e-6)
+    last = now
+    cv2.putText(frame, f"{fps:.1f} FPS", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+
+    cv2.imshow('Emotion Detector', frame)
     if cv2.waitKey(1) & 0xFF == ord('q'):
         break
 
 cap.release()
-cv2.destroyAllWindows()
\ No newline at end of file
+cv2.destroyAllWindows()
@@ -1,43 +1,121 @@
 """
 MongoDB database models and utilities for MoodTunes
 """
+import functools
 import os
+import threading
+from collections import defaultdict
 from datetime import datetime
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import AutoReconnect, BulkWriteError, ConnectionFailure, NetworkTimeout, PyMongoError
 from bson.objectid import ObjectId
-from werkzeug.security import generate_password_hash, check_password_hash
+
+import config
+from passwords import hasher
+from resilience import CircuitBreaker, HealthChecker
 
 MONGODB_URL = os.environ.get("MONGODB_URL", "mongodb://localhost:27017")
 DB_NAME = os.environ.get("DB_NAME", "moodtunes")
 
-# Initialize MongoDB connection
+
+class DatabaseUnavailable(ConnectionFailure):
+    """Raised without contacting the server while the circuit breaker is open"""
+
+
+# Errors worth retrying for queued writes
+TRANSIENT_ERRORS = (AutoReconnect, ConnectionFailure, NetworkTimeout)
+
+# Initialize MongoDB client. Construction does not contact the server;
+# connections are opened lazily from a bounded pool with short timeouts so an
+# unreachable server fails fast instead of stalling requests.
 try:
-    client = MongoClient(MONGODB_URL)
+    client = MongoClient(
+        MONGODB_URL,
+        maxPoolSize=config.MONGO_MAX_POOL_SIZE,
+        minPoolSize=config.MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=config.MONGO_MAX_IDLE_TIME_MS,
+        serverSelectionTimeoutMS=config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=config.MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=config.MONGO_SOCKET_TIMEOUT_MS,
+    )
     db = client[DB_NAME]
-    print(f"Connected to MongoDB: {DB_NAME}")
+    print(f"MongoDB client configured: {DB_NAME}")
 except Exception as e:
-    print(f"Failed to connect to MongoDB: {e}")
+    print(f"Failed to configure MongoDB client: {e}")
+    client = None
     db = None
 
+# Cached connection state: a background ping keeps the breaker current, and
+# request-path failures open it too, so check_db_connection() never blocks.
+breaker = CircuitBreaker(
+    "mongodb",
+    failure_threshold=config.MONGO_BREAKER_THRESHOLD,
+    reset_timeout=config.MONGO_BREAKER_RESET,
+)
+health = HealthChecker(
+    lambda: client.admin.command("ping"), breaker, interval=config.MONGO_HEALTH_INTERVAL
+) if client is not None else None
+_guard = threading.local()
+
+
+def _guarded(method):
+    """
+    Run a model method through the breaker: refuse it while open, and record
+    its outcome. Nested model calls count as part of the outermost one.
+    """
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if getattr(_guard, "active", False):
+            return method(*args, **kwargs)
+        if not breaker.allow():
+            raise DatabaseUnavailable("MongoDB circuit breaker is open")
+        _guard.active = True
+        try:
+            result = method(*args, **kwargs)
+        except TRANSIENT_ERRORS:
+            breaker.record_failure()
+            raise
+        except PyMongoError:
+            # The server answered, e.g. with a duplicate key error
+            breaker.record_success()
+            raise
+        except Exception:
+            breaker.release()
+            raise
+        finally:
+            _guard.active = False
+        breaker.record_success()
+        return result
+    return wrapper
+
 
 class MoodRecord:
     """Model for storing mood and emotion records"""
+
+    # Legacy records carry the whole base64 upload; left out of listings
+    # unless include_images is requested. New records hold only image_ref.
+    HEAVY_FIELDS = {"image_data": 0}
     
-    def __init__(self):
+    def __init__(self, rollups=None):
+        self.rollups = rollups
         if db is not None:
             self.collection = db["mood_records"]
-            # Create indexes
-            self.collection.create_index("email")
-            self.collection.create_index("created_at")
+
+    def ensure_indexes(self):
+        # Serve "records for email, newest first" and keyset paging from the
+        # index alone; _id breaks ties between equal timestamps
+        self.collection.create_index([("email", 1), ("created_at", -1), ("_id", -1)])
+        self.collection.create_index([("created_at", -1), ("_id", -1)])
     
-    def create(self, email=None, name=None, selected_mood=None, region=None, 
-               language=None, detected_emotion=None, confidence=None, 
-               spotify_tracks=None, image_data=None):
-        """Create a new mood record"""
+    @staticmethod
+    def build(email=None, name=None, selected_mood=None, region=None,
+              language=None, detected_emotion=None, confidence=None,
+              spotify_tracks=None, image_ref=None):
+        """Build a mood record document without writing it"""
         if detected_emotion is None:
             raise ValueError("detected_emotion is required")
-        
-        record = {
+
+        return {
             "email": email,
             "name": name,
             "selected_mood": selected_mood,
@@ -46,36 +124,90 @@ class MoodRecord:
             "detected_emotion": detected_emotion,
             "confidence": confidence,
             "spotify_tracks": spotify_tracks or [],
-            "image_data": image_data,
+            "image_ref": image_ref,
             "created_at": datetime.utcnow()
         }
-        
+
+    @_guarded
+    def create(self, **fields):
+        """Create a new mood record; image_ref points into the image store"""
+        record = self.build(**fields)
         result = self.collection.insert_one(record)
+        if self.rollups:
+            self.rollups.record([record])
         record["_id"] = str(result.inserted_id)
         return record
+
+    @_guarded
+    def create_many(self, records):
+        """Insert documents from build() in one round-trip"""
+        if not records:
+            return 0
+        try:
+            self.collection.insert_many(records, ordered=False)
+        except BulkWriteError as exc:
+            # Retrying a batch whose earlier attempt failed part-way (before its
+            # rollups were applied) only hits duplicates; anything else is real
+            errors = exc.details.get("writeErrors", [])
+            if not errors or any(err.get("code") != 11000 for err in errors):
+                raise
+        if self.rollups:
+            self.rollups.record(records)
+        return len(records)
     
-    def find_by_email(self, email, limit=10):
-        """Find mood records by email"""
+    def _projection(self, include_images):
+        return None if include_images else self.HEAVY_FIELDS
+
+    @staticmethod
+    def make_cursor(record):
+        """Keyset cursor "<created_at ISO>,<_id>" for the page after ``record``"""
+        return f"{record['created_at'].isoformat()},{record['_id']}"
+
+    @staticmethod
+    def parse_cursor(cursor):
+        """Parse a make_cursor() string; raises ValueError when malformed"""
+        created_at, _, record_id = cursor.rpartition(",")
+        try:
+            return datetime.fromisoformat(created_at), ObjectId(record_id)
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    @_guarded
+    def _find_page(self, query, limit, include_images, before):
+        if before:
+            created_at, record_id = self.parse_cursor(before)
+            query = {**query, "$or": [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "_id": {"$lt": record_id}},
+            ]}
         records = list(self.collection.find(
-            {"email": email}
-        ).sort("created_at", -1).limit(limit))
-        
+            query, self._projection(include_images)
+        ).sort([("created_at", -1), ("_id", -1)]).limit(limit))
+
+        next_before = self.make_cursor(records[-1]) if len(records) == limit else None
         # Convert ObjectId to string
         for record in records:
             record["_id"] = str(record["_id"])
-        
-        return records
+
+        return records, next_before
+
+    def find_page_by_email(self, email, limit=10, include_images=False, before=None):
+        """Page of mood records by email, newest first, plus the next cursor"""
+        return self._find_page({"email": email}, limit, include_images, before)
+
+    def find_page(self, limit=10, include_images=False, before=None):
+        """Page of all mood records, newest first, plus the next cursor"""
+        return self._find_page({}, limit, include_images, before)
+
+    def find_by_email(self, email, limit=10, include_images=False):
+        """Find mood records by email"""
+        return self.find_page_by_email(email, limit=limit, include_images=include_images)[0]
     
-    def find_all(self, limit=10):
+    def find_all(self, limit=10, include_images=False):
         """Find all mood records"""
-        records = list(self.collection.find().sort("created_at", -1).limit(limit))
-        
-        # Convert ObjectId to string
-        for record in records:
-            record["_id"] = str(record["_id"])
-        
-        return records
+        return self.find_page(limit=limit, include_images=include_images)[0]
     
+    @_guarded
     def find_by_id(self, record_id):
         """Find a mood record by ID"""
         try:
@@ -86,6 +218,7 @@ class MoodRecord:
         except:
             return None
     
+    @_guarded
     def update_by_id(self, record_id, update_data):
         """Update a mood record"""
         try:
@@ -97,6 +230,7 @@ class MoodRecord:
         except:
             return False
     
+    @_guarded
     def delete_by_id(self, record_id):
         """Delete a mood record"""
         try:
@@ -112,15 +246,18 @@ class UserPreference:
     def __init__(self):
         if db is not None:
             self.collection = db["user_preferences"]
-            self.collection.create_index("email", unique=True)
+
+    def ensure_indexes(self):
+        self.collection.create_index("email", unique=True)
     
-    def create_or_update(self, email, name=None, preferred_language=None, 
-                         preferred_region=None, spotify_token=None):
-        """Create or update user preferences"""
+    @staticmethod
+    def build(email, name=None, preferred_language=None,
+              preferred_region=None, spotify_token=None):
+        """Build the $set document for a preferences upsert"""
         if email is None:
             raise ValueError("email is required")
-        
-        user_data = {
+
+        return {
             "email": email,
             "name": name,
             "preferred_language": preferred_language,
@@ -128,7 +265,11 @@ class UserPreference:
             "spotify_token": spotify_token,
             "updated_at": datetime.utcnow()
         }
-        
+
+    @_guarded
+    def create_or_update(self, email, **fields):
+        """Create or update user preferences"""
+        user_data = self.build(email, **fields)
         result = self.collection.update_one(
             {"email": email},
             {"$set": user_data},
@@ -136,7 +277,19 @@ class UserPreference:
         )
         
         return result.upserted_id or result.matched_count > 0
+
+    @_guarded
+    def bulk_upsert(self, documents):
+        """Apply build() documents as ordered upserts in one round-trip"""
+        if not documents:
+            return 0
+        result = self.collection.bulk_write(
+            [UpdateOne({"email": doc["email"]}, {"$set": doc}, upsert=True) for doc in documents],
+            ordered=True,
+        )
+        return result.upserted_count + result.matched_count
     
+    @_guarded
     def find_by_email(self, email):
         """Find user preferences by email"""
         user = self.collection.find_one({"email": email})
@@ -144,6 +297,7 @@ class UserPreference:
             user["_id"] = str(user["_id"])
         return user
     
+    @_guarded
     def update_spotify_token(self, email, spotify_token):
         """Update Spotify token for user"""
         return self.collection.update_one(
@@ -152,8 +306,131 @@ class UserPreference:
         ).modified_count > 0
 
 
+class MoodRollup:
+    """Precomputed per-user and global emotion counts per day and hour.
+
+    One document per (scope, email, granularity, period) holds counts per
+    emotion, the total and the confidence sum, incremented on every insert,
+    so analytics never scan mood_records.
+    """
+
+    GRANULARITIES = ("day", "hour")
+
+    def __init__(self):
+        if db is not None:
+            self.collection = db["mood_rollups"]
+
+    def ensure_indexes(self):
+        self.collection.create_index(
+            [("scope", 1), ("email", 1), ("granularity", 1), ("period", 1)], unique=True
+        )
+
+    @staticmethod
+    def _period(created_at, granularity):
+        if granularity == "day":
+            return created_at.replace(hour=0, minute=0, second=0, microsecond=0)
+        return created_at.replace(minute=0, second=0, microsecond=0)
+
+    @_guarded
+    def record(self, records):
+        """Fold mood record documents into the rollups with one bulk upsert"""
+        increments = defaultdict(lambda: defaultdict(float))
+        for record in records:
+            emotion = record.get("detected_emotion")
+            created_at = record.get("created_at")
+            if not emotion or created_at is None:
+                continue
+            scopes = [("global", None)]
+            if record.get("email"):
+                scopes.append(("user", record["email"]))
+            for scope, email in scopes:
+                for granularity in self.GRANULARITIES:
+                    inc = increments[(scope, email, granularity, self._period(created_at, granularity))]
+                    inc[f"counts.{emotion}"] += 1
+                    inc["total"] += 1
+                    if record.get("confidence") is not None:
+                        inc["confidence_sum"] += record["confidence"]
+                        inc["confidence_n"] += 1
+        if not increments:
+            return 0
+        self.collection.bulk_write([
+            UpdateOne(
+                {"scope": scope, "email": email, "granularity": granularity, "period": period},
+                {"$inc": dict(inc)},
+                upsert=True,
+            )
+            for (scope, email, granularity, period), inc in increments.items()
+        ], ordered=False)
+        return len(increments)
+
+    @_guarded
+    def summary(self, email=None, since=None, granularity="day"):
+        """Emotion distribution, average confidence and time series from the rollups"""
+        match = {"scope": "user" if email else "global", "email": email, "granularity": granularity}
+        if since is not None:
+            match["period"] = {"$gte": self._period(since, granularity)}
+        avg_confidence = {"$cond": [
+            {"$gt": ["$confidence_n", 0]}, {"$divide": ["$confidence_sum", "$confidence_n"]}, None
+        ]}
+        result = next(self.collection.aggregate([
+            {"$match": match},
+            {"$facet": {
+                "series": [
+                    {"$sort": {"period": 1}},
+                    {"$project": {"_id": 0, "period": 1, "total": 1, "counts": 1,
+                                  "avg_confidence": avg_confidence}},
+                ],
+                "totals": [
+                    {"$group": {"_id": None, "total": {"$sum": "$total"},
+                                "confidence_sum": {"$sum": "$confidence_sum"},
+                                "confidence_n": {"$sum": "$confidence_n"}}},
+                    {"$project": {"_id": 0, "total": 1, "avg_confidence": avg_confidence}},
+                ],
+                "distribution": [
+                    {"$project": {"counts": {"$objectToArray": "$counts"}}},
+                    {"$unwind": "$counts"},
+                    {"$group": {"_id": "$counts.k", "count": {"$sum": "$counts.v"}}},
+                    {"$sort": {"count": -1}},
+                ],
+            }},
+        ]), {})
+        totals = (result.get("totals") or [{"total": 0, "avg_confidence": None}])[0]
+        total = totals["total"] or 0
+        return {
+            "total": int(total),
+            "avg_confidence": totals["avg_confidence"],
+            "distribution": {
+                row["_id"]: {"count": int(row["count"]), "share": (row["count"] / total) if total else 0.0}
+                for row in result.get("distribution", [])
+            },
+            "series": [
+                {**row, "period": row["period"].isoformat(), "total": int(row.get("total", 0)),
+                 "counts": {k: int(v) for k, v in row.get("counts", {}).items()}}
+                for row in result.get("series", [])
+            ],
+        }
+
+    @_guarded
+    def rebuild(self, batch_size=1000):
+        """Recompute all rollups from mood_records (backfill for existing data)"""
+        self.collection.delete_many({})
+        cursor = db["mood_records"].find(
+            {}, {"email": 1, "detected_emotion": 1, "confidence": 1, "created_at": 1}
+        ).batch_size(batch_size)
+        batch, count = [], 0
+        for record in cursor:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                self.record(batch)
+                count += len(batch)
+                batch = []
+        self.record(batch)
+        return count + len(batch)
+
+
 # Initialize collections
-mood_record = MoodRecord() if db is not None else None
+mood_rollup = MoodRollup() if db is not None else None
+mood_record = MoodRecord(mood_rollup) if db is not None else None
 user_preference = UserPreference() if db is not None else None
 
 
@@ -162,13 +439,16 @@ class UserModel:
     def __init__(self):
         if db is not None:
             self.collection = db["users"]
-            self.collection.create_index("email", unique=True)
 
+    def ensure_indexes(self):
+        self.collection.create_index("email", unique=True)
+
+    @_guarded
     def create_user(self, name, email, password):
         if not email or not password:
             raise ValueError("email and password are required")
 
-        hashed = generate_password_hash(password)
+        hashed = hasher.hash(password)
         user_doc = {
             "name": name,
             "email": email,
@@ -187,12 +467,14 @@ class UserModel:
             # Reraise to let caller handle duplicate key or other errors
             raise
 
+    @_guarded
     def find_by_email(self, email):
         user = self.collection.find_one({"email": email})
         if user:
             user["_id"] = str(user["_id"])
         return user
 
+    @_guarded
     def verify_password(self, email, password):
         user = self.collection.find_one({"email": email})
         if not user:
@@ -200,7 +482,13 @@ class UserModel:
         stored = user.get("password_hash")
         if not stored:
             return False, None
-        ok = check_password_hash(stored, password)
+        ok, needs_rehash = hasher.verify(stored, password)
+        if ok and needs_rehash:
+            # Stored with older hashing parameters: upgrade transparently
+            self.collection.update_one(
+                {"_id": user["_id"]},
+                {"$set": {"password_hash": hasher.hash(password), "updated_at": datetime.utcnow()}}
+            )
         if ok:
             user_copy = {k: v for k, v in user.items() if k != "password_hash"}
             user_copy["_id"] = str(user_copy.get("_id"))
@@ -211,6 +499,32 @@ class UserModel:
 users = UserModel() if db is not None else None
 
 
+def ensure_indexes():
+    """Create collection indexes; called from the startup phase, not at import,
+    because index creation blocks until the server is reachable."""
+    if health is not None:
+        health.start()
+    for model in (mood_record, mood_rollup, user_preference, users):
+        if model is not None:
+            model.ensure_indexes()
+
+
 def check_db_connection():
-    """Check if MongoDB connection is available"""
-    return db is not None
+    """
+    Check if MongoDB is available from the cached health state (never blocks).
+    Side-effect free: the half-open trial is claimed by the model call itself.
+    """
+    if db is None:
+        return False
+    health.start()
+    return not breaker.is_open()
+
+
+def report_db_error(exc=None):
+    """Failed model calls are counted by _guarded; only count failures reported without an exception"""
+    if exc is None:
+        breaker.record_failure()
+
+
+def db_health():
+    return health.stats() if health is not None else {"state": "unconfigured"}
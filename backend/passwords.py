@@ -0,0 +1,101 @@
+"""
+Password hashing off the request threads.
+
+werkzeug's KDFs are deliberately slow. Hashes and checks run on a small
+dedicated pool (PASSWORD_HASH_WORKERS) with a bounded backlog, so a burst of
+logins cannot take every worker thread's CPU away from emotion detection.
+PASSWORD_HASH_METHOD sets the work factor; hashes made with other
+parameters are flagged for rehashing on the next successful login. Login
+attempts are rate limited per email.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+import config
+
+
+class HasherBusy(RuntimeError):
+    """Raised when the hashing backlog is full."""
+
+
+class PasswordHasher:
+    def __init__(self, method, workers=2, max_pending=32, timeout=10.0):
+        self.method = method
+        self.timeout = timeout
+        self._prefix = None
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("Too many concurrent password operations; try again shortly.")
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result(timeout=self.timeout)
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, stored_hash, password):
+        """Returns (ok, needs_rehash)"""
+        ok = self._run(check_password_hash, stored_hash, password)
+        return ok, ok and self.needs_rehash(stored_hash)
+
+    def needs_rehash(self, stored_hash):
+        """True when ``stored_hash`` was made with a different method or work factor"""
+        return stored_hash.split("$", 1)[0] != self._method_prefix()
+
+    def _method_prefix(self):
+        # werkzeug fills in defaults, e.g. "scrypt" -> "scrypt:32768:8:1"
+        if self._prefix is None:
+            self._prefix = generate_password_hash("", self.method).split("$", 1)[0]
+        return self._prefix
+
+
+class AttemptLimiter:
+    """Sliding-window limit of attempts per key, with a bounded number of tracked keys."""
+
+    def __init__(self, max_attempts=10, window=300.0, max_keys=100000):
+        self.max_attempts = max_attempts
+        self.window = window
+        self.max_keys = max_keys
+        self._attempts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key):
+        """Record an attempt; returns seconds to wait when over the limit, else 0."""
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._attempts.pop(key, None) or deque()
+            while attempts and now - attempts[0] > self.window:
+                attempts.popleft()
+            self._attempts[key] = attempts
+            while len(self._attempts) > self.max_keys:
+                self._attempts.popitem(last=False)
+            if len(attempts) >= self.max_attempts:
+                return self.window - (now - attempts[0])
+            attempts.append(now)
+            return 0
+
+    def reset(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+
+hasher = PasswordHasher(
+    config.PASSWORD_HASH_METHOD,
+    workers=config.PASSWORD_HASH_WORKERS,
+    max_pending=config.PASSWORD_HASH_MAX_PENDING,
+)
+login_limiter = AttemptLimiter(
+    max_attempts=config.LOGIN_MAX_ATTEMPTS,
+    window=config.LOGIN_ATTEMPT_WINDOW,
+)
@@ -1,3 +1,42 @@
+import logging
+import os
+import threading
+
+import numpy as np
+
+import config
+from catalog import directory_lock, get_catalog
+
+logger = logging.getLogger(__name__)
+
+# Simple emotion -> audio feature mapping
+# Targets follow literature (valence ~ positivity, energy ~ arousal); seed genres guide mood. [9]
+EMOTION_MAPPING = {
+    "happy": dict(target_valence=0.85, target_energy=0.7, seed_genres=["pop", "dance"]),
+    "sad": dict(target_valence=0.2, target_energy=0.3, seed_genres=["acoustic", "indie"]),
+    "angry": dict(target_valence=0.2, target_energy=0.85, seed_genres=["metal", "rock"]),
+    "disgust": dict(target_valence=0.1, target_energy=0.4, seed_genres=["punk", "grunge"]),
+    "fear": dict(target_valence=0.25, target_energy=0.6, seed_genres=["ambient", "classical"]),
+    "surprise": dict(
+        target_valence=0.7, target_energy=0.8, seed_genres=["edm", "electronic"]
+    ),
+    "neutral": dict(target_valence=0.5, target_energy=0.5, seed_genres=["chill", "lofi"]),
+}
+
+# Optional: add constraints supported by Spotify recommendations (danceability, acousticness, loudness, tempo) [9]
+def build_target_params(emotion_cfg):
+    params = {
+        "target_valence": emotion_cfg["target_valence"],
+        "target_energy": emotion_cfg["target_energy"],
+    }
+    # Example heuristics: more acoustic for sad/fear; more danceable for happy/surprise. [9]
+    if any(genre in ("acoustic", "indie", "ambient", "classical") for genre in emotion_cfg["seed_genres"]):
+        params["max_loudness"] = -5
+        params["target_acousticness"] = 0.6
+    else:
+        params["target_danceability"] = 0.6
+    return params
+
 RECOMMENDATION_LIBRARY = {
     "happy": [
         {
@@ -152,8 +191,259 @@ RECOMMENDATION_LIBRARY = {
 }
 
 
-def get_recommendations_for_emotion(emotion, limit=5):
-    key = (emotion or "neutral").lower()
-    playlist = RECOMMENDATION_LIBRARY.get(key) or RECOMMENDATION_LIBRARY["neutral"]
-    return playlist[:max(1, min(limit or 5, len(playlist)))]
+# Audio features the local recommender matches against the emotion targets
+TARGET_FEATURES = ("valence", "energy", "danceability", "acousticness")
+
+
+def emotion_targets(emotion):
+    """
+    (targets, weights) over TARGET_FEATURES for one emotion, from the same
+    parameters sent to Spotify; features the mapping leaves open get weight 0.
+    """
+    params = build_target_params(EMOTION_MAPPING.get(emotion, EMOTION_MAPPING["neutral"]))
+    targets = np.array([params.get(f"target_{f}", 0.0) for f in TARGET_FEATURES], dtype=np.float32)
+    weights = np.array([float(f"target_{f}" in params) for f in TARGET_FEATURES], dtype=np.float32)
+    return targets, weights
+
+
+EMOTIONS = list(EMOTION_MAPPING)
+_EMOTION_INDEX = {emotion: i for i, emotion in enumerate(EMOTIONS)}
+_TARGETS, _WEIGHTS = (np.stack(arrays) for arrays in zip(*(emotion_targets(e) for e in EMOTIONS)))
+
+
+def emotion_distribution(emotion=None, confidence=None, probabilities=None):
+    """
+    Probability vector over EMOTIONS. Uses ``probabilities`` ({label: p}) when
+    given; otherwise puts ``confidence`` on ``emotion`` and the rest on neutral,
+    but never less than RECOMMENDER_MIN_EMOTION_SHARE on ``emotion`` so a
+    low-confidence label still leads the blend.
+    """
+    dist = np.zeros(len(EMOTIONS), dtype=np.float32)
+    for label, value in (probabilities or {}).items():
+        if label in _EMOTION_INDEX:
+            dist[_EMOTION_INDEX[label]] = max(0.0, float(value))
+    if dist.sum() <= 0:
+        label = (emotion or "neutral").lower()
+        confidence = 1.0 if confidence is None else min(1.0, max(0.0, float(confidence)))
+        share = max(confidence, config.RECOMMENDER_MIN_EMOTION_SHARE)
+        dist[_EMOTION_INDEX.get(label, _EMOTION_INDEX["neutral"])] += share
+        dist[_EMOTION_INDEX["neutral"]] += 1.0 - share
+    return dist / dist.sum()
+
+
+def blend_targets(dist):
+    """Per-feature weights w and weighted targets w * t blended over the emotion distribution."""
+    return dist @ _WEIGHTS, dist @ (_WEIGHTS * _TARGETS)
+
+
+# Bump when the row layout below changes, so saved matrices are rebuilt
+MATRIX_FORMAT = 1
+MATRIX_FILE = f"feature_matrix.v{MATRIX_FORMAT}.npy"
+
+
+class FeatureMatrix:
+    """
+    A catalog's target features laid out for scoring every track in one matrix-vector product.
+
+    The weighted squared distance sum_f w_f * (x_f - t_f)^2 expands to
+    x^2 . w - 2 x . (w * t) + const, and the label bonus is a dot product
+    with a one-hot row per emotion. So the rows are [x^2; x; one-hot labels],
+    stored as a (rows x tracks) float32 array. For converted catalogs it is
+    saved next to the catalog arrays and memory-mapped (see for_catalog()).
+    """
+
+    def __init__(self, catalog, rows=None):
+        self.catalog = catalog
+        # Optional ann.IVFIndex over these features, attached by get_feature_matrix()
+        self.ann_index = None
+        self.rows = self.build_rows(catalog) if rows is None else rows
+
+    @staticmethod
+    def build_rows(catalog):
+        n_features = len(TARGET_FEATURES)
+        x = np.stack([np.nan_to_num(catalog.features[f], nan=0.5) for f in TARGET_FEATURES]).astype(np.float32)
+        # Catalog emotion code -> position in EMOTIONS (-1 for unlabelled/unknown)
+        code_to_emotion = np.array([_EMOTION_INDEX.get(v, -1) for v in catalog.tables["emotion"]], dtype=np.int64)
+        labels = code_to_emotion[np.asarray(catalog.codes["emotion"])]
+        rows = np.empty((2 * n_features + len(EMOTIONS), len(catalog)), dtype=np.float32)
+        np.multiply(x, x, out=rows[:n_features])
+        rows[n_features:2 * n_features] = x
+        for i in range(len(EMOTIONS)):
+            rows[2 * n_features + i] = labels == i
+        return rows
+
+    @classmethod
+    def for_catalog(cls, catalog):
+        """
+        Matrix for ``catalog``. Converted catalogs memory-map rows saved in
+        their directory (built once, under the catalog's directory lock), so
+        worker processes share the pages instead of each holding a copy.
+        """
+        if not catalog.directory:
+            return cls(catalog)
+        path = os.path.join(catalog.directory, MATRIX_FILE)
+        shape = (2 * len(TARGET_FEATURES) + len(EMOTIONS), len(catalog))
+        rows = _load_rows(path, shape)
+        if rows is None:
+            try:
+                with directory_lock(catalog.directory):
+                    rows = _load_rows(path, shape)
+                    if rows is None:
+                        tmp = f"{path[:-4]}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+                        np.save(tmp, cls.build_rows(catalog))
+                        os.replace(tmp, path)
+                        rows = _load_rows(path, shape)
+            except OSError as exc:
+                logger.warning("Cannot save the feature matrix in %s: %s", catalog.directory, exc)
+                return cls(catalog)
+        return cls(catalog, rows)
+
+    def features(self):
+        """(features x tracks) view of the raw target features."""
+        n_features = len(TARGET_FEATURES)
+        return self.rows[n_features:2 * n_features]
+
+    def scores(self, dist, label_weight=0.0, candidates=None):
+        """
+        Distance of every track (or only the ``candidates`` rows) to the
+        blended targets of ``dist`` (lower is better), minus ``label_weight``
+        times the probability of its labelled emotion.
+        """
+        weights, weighted_targets = blend_targets(dist)
+        vector = np.concatenate([weights, -2.0 * weighted_targets, -label_weight * dist]).astype(np.float32)
+        n = len(vector) if label_weight else 2 * len(TARGET_FEATURES)
+        rows = self.rows[:n] if candidates is None else self.rows[:n, candidates]
+        return vector[:n] @ rows
+
+
+def _load_rows(path, shape):
+    try:
+        rows = np.load(path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    return rows if rows.shape == shape and rows.dtype == np.float32 else None
+
+
+def top_k(scores, k):
+    """Indices of the ``k`` lowest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(scores[candidates], kind="stable")]
+
+
+_matrix = None
+_matrix_lock = threading.Lock()
+
+
+def get_feature_matrix():
+    """FeatureMatrix for the current catalog, rebuilt when the catalog is reloaded."""
+    global _matrix
+    catalog = get_catalog()
+    matrix = _matrix
+    if matrix is None or matrix.catalog is not catalog:
+        with _matrix_lock:
+            if _matrix is None or _matrix.catalog is not catalog:
+                matrix = FeatureMatrix.for_catalog(catalog)
+                if config.ANN_INDEX and len(catalog) >= config.ANN_MIN_TRACKS:
+                    from ann import load_index
+
+                    matrix.ann_index = load_index(catalog)
+                _matrix = matrix
+            matrix = _matrix
+    return matrix
+
+
+def nearest_rows(matrix, dist, limit, index=None, nprobe=None):
+    """
+    Catalog rows of the ``limit`` best tracks for ``dist``. With an ANN
+    ``index`` only the candidates from its ``nprobe`` closest clusters are scored.
+    """
+    label_weight = config.RECOMMENDER_LABEL_WEIGHT
+    if index is None:
+        return top_k(matrix.scores(dist, label_weight=label_weight), limit)
+    weights, weighted_targets = blend_targets(dist)
+    candidates = index.candidates(
+        weights, weighted_targets, nprobe=nprobe or config.ANN_NPROBE, min_count=limit
+    )
+    return candidates[top_k(matrix.scores(dist, label_weight=label_weight, candidates=candidates), limit)]
+
+
+def rerank(matrix, rows, scores, limit, exclude_ids=None, language=None, region=None):
+    """
+    Personalize a candidate pool of ``rows`` (``scores``: lower is better).
+
+    Only tracks scoring within RERANK_MAX_SCORE_GAP of the best candidate
+    are re-ranked. Tracks in the user's language or region get a relevance
+    boost, and the picks are made by maximal marginal relevance, so
+    near-duplicates in feature space are spread out. Tracks whose id is in
+    ``exclude_ids`` are skipped. If too few tracks are left, the best
+    excluded ones fill the list, and only then the farther candidates.
+    """
+    catalog = matrix.catalog
+    order = np.argsort(scores, kind="stable")
+    rows, scores = rows[order], scores[order]
+    if exclude_ids:
+        fresh = np.array([catalog.text("id", int(row)) not in exclude_ids for row in rows], dtype=bool)
+    else:
+        fresh = np.ones(len(rows), dtype=bool)
+    near = scores <= scores[0] + config.RERANK_MAX_SCORE_GAP if len(rows) else fresh
+    fallback = np.concatenate([rows[~fresh], rows[fresh & ~near]])
+    rows, scores = rows[fresh & near], scores[fresh & near]
+    if not len(rows):
+        return fallback[:limit]
+
+    spread = float(scores.max() - scores.min())
+    relevance = (scores.max() - scores) / spread if spread > 0 else np.ones(len(rows), dtype=np.float32)
+    for column, value, boost in (
+        ("language", language, config.RERANK_LANGUAGE_BOOST),
+        ("region", region, config.RERANK_REGION_BOOST),
+    ):
+        code = catalog.code(column, value) if value else None
+        if code:
+            relevance = relevance + boost * (np.asarray(catalog.codes[column])[rows] == code)
+
+    features = np.ascontiguousarray(matrix.features()[:, rows].T)
+    diversity = config.RERANK_DIVERSITY
+    max_similarity = np.zeros(len(rows), dtype=np.float32)
+    available = np.ones(len(rows), dtype=bool)
+    picked = []
+    for _ in range(min(limit, len(rows))):
+        mmr = np.where(available, (1.0 - diversity) * relevance - diversity * max_similarity, -np.inf)
+        best = int(np.argmax(mmr))
+        picked.append(best)
+        available[best] = False
+        # Similarity in [0, 1]: features lie in [0, 1], so distances are at most 2
+        similarity = 1.0 - np.linalg.norm(features - features[best], axis=1) / 2.0
+        np.maximum(max_similarity, similarity, out=max_similarity)
+    return np.concatenate([rows[picked], fallback[:limit - len(picked)]])
+
+
+def get_recommendations_for_emotion(emotion, limit=5, confidence=None, probabilities=None,
+                                    exclude_ids=None, language=None, region=None):
+    """
+    Nearest tracks in the local catalog to the emotion's audio-feature targets.
+
+    ``probabilities`` ({label: p}, e.g. a detection's full output) blends the
+    targets of every likely emotion; with only ``emotion`` and ``confidence``
+    the remainder is blended towards neutral. No network calls. Large
+    catalogs with a built ANN index (ann.py) only score its candidates.
+
+    Passing ``exclude_ids`` (recently served track ids), ``language`` or
+    ``region`` re-ranks a larger candidate pool for the user; see rerank().
+    """
+    dist = emotion_distribution(emotion, confidence=confidence, probabilities=probabilities)
+    matrix = get_feature_matrix()
+    limit = max(1, limit or 5)
+    if not (exclude_ids or language or region):
+        return matrix.catalog.tracks(nearest_rows(matrix, dist, limit, index=matrix.ann_index))
 
+    pool = limit * config.RERANK_POOL_FACTOR + len(exclude_ids or ())
+    rows = nearest_rows(matrix, dist, pool, index=matrix.ann_index)
+    scores = matrix.scores(dist, label_weight=config.RECOMMENDER_LABEL_WEIGHT, candidates=rows)
+    rows = rerank(matrix, rows, scores, limit, exclude_ids=exclude_ids, language=language, region=region)
+    return matrix.catalog.tracks(rows)
@@ -0,0 +1,143 @@
+"""
+Circuit breaker and background health checks for external dependencies.
+
+A CircuitBreaker opens after ``failure_threshold`` consecutive failures so
+callers can skip a dependency instantly instead of waiting for timeouts;
+after ``reset_timeout`` seconds it lets a single trial call through
+(half-open) and closes again on success. A HealthChecker probes the
+dependency on a daemon thread and feeds the same breaker, so the cached
+state stays fresh without putting probes on the request path.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=10.0):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def is_open(self):
+        """True while calls are refused outright; unlike allow() this never claims the half-open trial."""
+        return self.state == self.OPEN
+
+    def allow(self):
+        """True when a call may go ahead; in half-open state only one trial call is allowed."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            if self._trial_in_flight:
+                return False
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("Circuit %s closed", self.name)
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def release(self):
+        """End a trial call that failed for reasons unrelated to the dependency."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning("Circuit %s opened after %d failures", self.name, self._failures)
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def trip(self):
+        """Open immediately, e.g. when a health probe fails."""
+        with self._lock:
+            if self._state != self.OPEN:
+                logger.warning("Circuit %s opened by failed health check", self.name)
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def stats(self):
+        return {"name": self.name, "state": self.state, "consecutive_failures": self._failures}
+
+
+class HealthChecker:
+    """Runs ``probe()`` every ``interval`` seconds on a daemon thread and reports to ``breaker``."""
+
+    def __init__(self, probe, breaker, interval=5.0):
+        self.probe = probe
+        self.breaker = breaker
+        self.interval = interval
+        self.last_checked = None
+        self.last_ok = None
+        self.last_latency_ms = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f"health-{self.breaker.name}", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def check(self):
+        started = time.perf_counter()
+        try:
+            self.probe()
+            ok = True
+        except Exception:
+            ok = False
+        self.last_latency_ms = (time.perf_counter() - started) * 1000.0
+        self.last_checked = time.time()
+        self.last_ok = ok
+        if ok:
+            self.breaker.record_success()
+        else:
+            self.breaker.trip()
+        return ok
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.check()
+            self._stop.wait(self.interval)
+
+    def stats(self):
+        return {
+            "last_checked": self.last_checked,
+            "last_ok": self.last_ok,
+            "last_latency_ms": self.last_latency_ms,
+            **self.breaker.stats(),
+        }
@@ -1,61 +1,299 @@
 # routes.py
 import base64
 import json
+import threading
+from collections import deque
+from datetime import datetime, timedelta
 
 import cv2
 import numpy as np
-from flask import Blueprint, request, jsonify, current_app
-
-from mongo_db import mood_record, user_preference, users, check_db_connection
-from emotion import detect_emotion_from_image
+from flask import Blueprint, Response, request, jsonify, current_app
+
+from storage import (
+    check_db_connection, db_health, mood_record, mood_rollup, report_db_error, user_preference, users,
+)
+import config
+from caching import TTLCache
+from image_store import get_image_store, save_image
+from passwords import HasherBusy, login_limiter
+from emotion import EMOTION_LABELS, ROI_SIZE, classify_face_crops, detect_emotions_from_image, get_scheduler
 from recommendations import get_recommendations_for_emotion
+from smoothing import SmootherRegistry
+from streaming import get_manager
+from tokens import InvalidToken, issue_token, verify_token
+from write_behind import add_failure_listener, get_writer
 
 emotion_bp = Blueprint("emotion_bp", __name__)
 
+_smoothers = SmootherRegistry(EMOTION_LABELS, max_sessions=config.SMOOTHING_MAX_SESSIONS)
+
+# Per-process caches of user and preference documents keyed by email
+_user_cache = TTLCache(maxsize=config.USER_CACHE_SIZE, ttl=config.USER_CACHE_TTL)
+_preference_cache = TTLCache(maxsize=config.USER_CACHE_SIZE, ttl=config.USER_CACHE_TTL)
+# Track ids recently served to each user, so re-ranking can skip them
+_recent_tracks = TTLCache(maxsize=config.USER_CACHE_SIZE, ttl=config.RECENT_TRACKS_TTL)
+_recent_tracks_lock = threading.Lock()
+
+
+FACE_CROP_MIMETYPE = "application/x-face-gray48"
+FACE_CROP_BYTES = ROI_SIZE * ROI_SIZE
+
+
+def _decode_image(buffer):
+    """Decode encoded image bytes (any buffer) without an intermediate copy."""
+    if not buffer:
+        return None
+    return cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def _decode_face_crop(buffer):
+    """Interpret raw bytes as a pre-cropped 48x48 8-bit grayscale face."""
+    if buffer is None or len(buffer) != FACE_CROP_BYTES:
+        return None
+    return np.frombuffer(buffer, dtype=np.uint8).reshape(ROI_SIZE, ROI_SIZE)
+
+
+def _read_detect_request():
+    """
+    Parse the three /api/detect upload modes into
+    (options, image, face_crop, error_message).
+
+    - application/json: base64 data URL in image_data, options in the body
+    - multipart/form-data: file field "image" (encoded) or "face" (raw 48x48
+      grayscale), options as form fields
+    - raw body: image/* or application/octet-stream holds encoded image bytes,
+      application/x-face-gray48 holds a raw 48x48 grayscale face; options in
+      the query string
+    """
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return None, None, None, "JSON body must be an object"
+        if "image_data" not in payload:
+            return None, None, None, "image_data is required"
+        image_data = payload["image_data"]
+        try:
+            _, headerless = image_data.split(",", 1) if "," in image_data else ("", image_data)
+            image_bytes = base64.b64decode(headerless)
+        except (ValueError, TypeError, AttributeError):
+            return None, None, None, "Unable to parse image_data"
+        return payload, _decode_image(image_bytes), None, None
+
+    if request.mimetype == "multipart/form-data":
+        options = request.form.to_dict()
+        if "metadata" in options:
+            try:
+                options["metadata"] = json.loads(options["metadata"])
+            except ValueError:
+                options["metadata"] = {}
+        if "face" in request.files:
+            face = _decode_face_crop(request.files["face"].read())
+            if face is None:
+                return None, None, None, f"face must be {FACE_CROP_BYTES} bytes of 48x48 grayscale"
+            return options, None, face, None
+        if "image" in request.files:
+            return options, _decode_image(request.files["image"].read()), None, None
+        return None, None, None, "image or face file is required"
+
+    options = request.args.to_dict()
+    options["metadata"] = {key: request.args.get(key) for key in ("email", "name", "region", "language")}
+    body = request.get_data(cache=False)
+    if request.mimetype == FACE_CROP_MIMETYPE:
+        face = _decode_face_crop(body)
+        if face is None:
+            return None, None, None, f"face must be {FACE_CROP_BYTES} bytes of 48x48 grayscale"
+        return options, None, face, None
+    if request.mimetype.startswith("image/") or request.mimetype == "application/octet-stream":
+        return options, _decode_image(body), None, None
+    return None, None, None, "image_data is required"
+
+
+def _tokens_enabled():
+    """Tokens signed with the public development key could be forged by anyone."""
+    return current_app.secret_key not in (None, "", config.DEV_SECRET_KEY)
+
+
+def _request_email(claimed=None):
+    """
+    Resolve the user a request acts for as (email, error_response).
+
+    A valid "Authorization: Bearer <token>" from /auth/login identifies the
+    user, and a different claimed email is refused. Without a token the
+    claimed email is used as before, unless AUTH_REQUIRED is set.
+    """
+    header = request.headers.get("Authorization", "")
+    if header[:7].lower() == "bearer ":
+        if not _tokens_enabled():
+            return None, (jsonify({"error": "Bearer tokens are disabled until SECRET_KEY is set"}), 401)
+        try:
+            claims = verify_token(current_app.secret_key, header[7:].strip())
+        except InvalidToken as exc:
+            return None, (jsonify({"error": str(exc)}), 401)
+        if claimed and claimed != claims["sub"]:
+            return None, (jsonify({"error": "Token does not match email"}), 403)
+        return claims["sub"], None
+    if claimed and config.AUTH_REQUIRED:
+        return None, (jsonify({"error": "Authentication required"}), 401)
+    return claimed, None
+
+
+def _cached_preferences(email):
+    preferences = _preference_cache.get(email)
+    if preferences is None:
+        preferences = user_preference.find_by_email(email)
+        if preferences:
+            _preference_cache.set(email, preferences)
+    return preferences
+
+
+def _forget_dropped_preferences(kind, documents):
+    """Drop write-through cache entries whose queued upsert was never persisted."""
+    if kind == "preference":
+        for document in documents:
+            _preference_cache.invalidate(document.get("email"))
+
+
+add_failure_listener(_forget_dropped_preferences)
+
+
+def _cached_user(email):
+    user = _user_cache.get(email)
+    if user is None:
+        user = users.find_by_email(email)
+        if user:
+            user = {k: v for k, v in user.items() if k != "password_hash"}
+            _user_cache.set(email, user)
+    return user
+
+
+def _recent_track_ids(email):
+    """Ids recently served to ``email``; seeded from mood history once per RECENT_TRACKS_TTL."""
+    recent = _recent_tracks.get(email)
+    if recent is None:
+        recent = deque(maxlen=config.RECENT_TRACKS_PER_USER)
+        if check_db_connection() and mood_record:
+            try:
+                records, _ = mood_record.find_page_by_email(email, limit=10)
+                for record in reversed(records):
+                    recent.extend(t.get("id") for t in (record.get("spotify_tracks") or []) if t.get("id"))
+            except Exception as e:
+                report_db_error(e)
+                current_app.logger.warning(f"Failed to load recent tracks: {e}")
+        _recent_tracks.set(email, recent)
+    with _recent_tracks_lock:
+        return set(recent)
+
+
+def _remember_tracks(email, tracks):
+    recent = _recent_tracks.get(email)
+    if recent is not None:
+        with _recent_tracks_lock:
+            recent.extend(t["id"] for t in tracks if t.get("id"))
+
+
+def _personalization(email, metadata):
+    """Re-ranking arguments for get_recommendations_for_emotion (empty for anonymous requests)."""
+    if not email:
+        return {}
+    language, region = metadata.get("language"), metadata.get("region")
+    if not (language and region) and check_db_connection() and user_preference:
+        try:
+            preferences = _cached_preferences(email) or {}
+            language = language or preferences.get("preferred_language")
+            region = region or preferences.get("preferred_region")
+        except Exception as e:
+            current_app.logger.warning(f"Failed to load preferences: {e}")
+    return {"exclude_ids": _recent_track_ids(email), "language": language, "region": region}
+
+
+def _save_image_ref(image):
+    """Store the upload as a thumbnail; persistence must not fail the request."""
+    try:
+        return save_image(image)
+    except Exception as e:
+        current_app.logger.exception(f"Failed to store image: {e}")
+        return None
+
+
+def _include_images():
+    return request.args.get("include_images", "").lower() in ("1", "true", "yes")
+
 
 @emotion_bp.route("/detect", methods=["POST"])
 def detect():
     """
     Detect emotion from image and return recommendations.
-    Expects JSON payload with:
+    Accepts a JSON payload, a multipart form or a raw image body (see
+    _read_detect_request); the JSON payload has:
     - image_data: base64 encoded image
     - metadata: dict with email, name, region, language
     - limit: max number of recommendations (default 5, max 10)
+    - max_faces: optional cap on the number of faces classified
+    - session_id: optional live-session id; the emotion is then smoothed across
+      the session's frames, and recommendations (tracks) and the mood record
+      are only produced when the smoothed emotion changes (tracks is null otherwise)
+    A pre-cropped 48x48 face skips decoding and face detection entirely.
     """
-    payload = request.get_json(silent=True)
-    if not payload or "image_data" not in payload:
-        return jsonify({"error": "image_data is required"}), 400
+    # Reject bad bearer tokens before paying for decoding and inference
+    _, auth_error = _request_email()
+    if auth_error:
+        return auth_error
+
+    payload, image, face_crop, error = _read_detect_request()
+    if error:
+        return jsonify({"error": error}), 400
 
-    image_data = payload["image_data"]
     limit = payload.get("limit", 5)
     try:
         limit = min(10, max(1, int(limit)))
     except (TypeError, ValueError):
         limit = 5
 
+    max_faces = payload.get("max_faces")
     try:
-        _, headerless = image_data.split(",", 1) if "," in image_data else ("", image_data)
-        image_bytes = base64.b64decode(headerless)
-    except (ValueError, TypeError):
-        return jsonify({"error": "Unable to parse image_data"}), 400
-
-    array = np.frombuffer(image_bytes, dtype=np.uint8)
-    image = cv2.imdecode(array, cv2.IMREAD_COLOR)
-    if image is None:
+        max_faces = max(1, int(max_faces)) if max_faces is not None else None
+    except (TypeError, ValueError):
+        max_faces = None
+
+    metadata = payload.get("metadata") or {}
+    if not isinstance(metadata, dict):
+        return jsonify({"error": "metadata must be an object"}), 400
+    metadata = dict(metadata)
+    email, auth_error = _request_email(metadata.get("email"))
+    if auth_error:
+        return auth_error
+    metadata["email"] = email
+
+    if image is None and face_crop is None:
         return jsonify({"error": "Unable to decode image data"}), 400
 
     try:
-        label, confidence = detect_emotion_from_image(image)
-        tracks = get_recommendations_for_emotion(label, limit=limit)
-        metadata = payload.get("metadata", {}) or {}
+        if face_crop is not None:
+            faces = classify_face_crops([face_crop])
+        else:
+            faces = detect_emotions_from_image(image, max_faces=max_faces)
+        label, confidence = faces[0]["emotion"], faces[0]["confidence"]
+        smoothed = None
+        if payload.get("session_id"):
+            smoothed = _smoothers.update(str(payload["session_id"]), faces[0]["probabilities"])
+            label, confidence = smoothed["emotion"], smoothed["confidence"]
+        changed = smoothed is None or smoothed["changed"]
+
+        tracks = None
+        if changed:
+            probabilities = smoothed["probabilities"] if smoothed else dict(zip(EMOTION_LABELS, faces[0]["probabilities"]))
+            tracks = get_recommendations_for_emotion(
+                label, limit=limit, confidence=confidence, probabilities=probabilities,
+                **_personalization(email, metadata)
+            )
+            if email:
+                _remember_tracks(email, tracks)
         
         # Save to MongoDB if available
-        if check_db_connection() and mood_record:
+        if changed and check_db_connection() and mood_record:
             try:
                 email = metadata.get("email")
-                
-                # Save mood record
-                mood_record.create(
+                record = mood_record.build(
                     email=email,
                     name=metadata.get("name"),
                     region=metadata.get("region"),
@@ -63,24 +301,44 @@ def detect():
                     detected_emotion=label,
                     confidence=confidence,
                     spotify_tracks=tracks,
-                    image_data=image_data
+                    image_ref=_save_image_ref(image)
                 )
-                
-                # Update user preferences if email exists
-                if email:
-                    user_preference.create_or_update(
-                        email=email,
-                        name=metadata.get("name"),
-                        preferred_language=metadata.get("language"),
-                        preferred_region=metadata.get("region")
-                    )
+                preference = user_preference.build(
+                    email,
+                    name=metadata.get("name"),
+                    preferred_language=metadata.get("language"),
+                    preferred_region=metadata.get("region")
+                ) if email else None
+
+                # Queue for the write-behind flusher; write inline if it is
+                # disabled or full
+                writer = get_writer()
+                if writer is None or not writer.submit("mood_record", record):
+                    mood_record.create_many([record])
+                if preference and (writer is None or not writer.submit("preference", preference)):
+                    user_preference.bulk_upsert([preference])
+                if preference:
+                    # Write through: the queued upsert may not be flushed yet,
+                    # so a reload from the database could still be stale. A
+                    # dropped upsert invalidates the entry (_forget_dropped_preferences)
+                    _preference_cache.set(email, {**(_preference_cache.get(email) or {}), **preference})
             except Exception as e:
+                report_db_error(e)
                 current_app.logger.exception(f"Failed to save mood record: {e}")
         
         return jsonify({
             "emotion": label,
             "confidence": round(confidence, 4),
             "tracks": tracks,
+            "faces": [
+                {
+                    "emotion": face["emotion"],
+                    "confidence": round(face["confidence"], 4),
+                    "box": face["box"],
+                }
+                for face in faces
+            ],
+            "smoothed": smoothed,
             "message": "Emotion detected successfully"
         })
         
@@ -92,15 +350,108 @@ def detect():
         return jsonify({"error": "Failed to detect emotion"}), 500
 
 
+@emotion_bp.route("/stream", methods=["POST"])
+def open_stream():
+    """
+    Open a live emotion stream.
+    Optional JSON payload: { max_faces }
+    Frames are POSTed to frames_url as raw image bytes (e.g. image/jpeg) and
+    results are read from events_url as server-sent events.
+    """
+    payload = request.get_json(silent=True) or {}
+    max_faces = payload.get("max_faces")
+    try:
+        max_faces = max(1, int(max_faces)) if max_faces is not None else None
+    except (TypeError, ValueError):
+        max_faces = None
+
+    try:
+        stream = get_manager().open(max_faces=max_faces)
+    except RuntimeError as exc:
+        return jsonify({"error": str(exc)}), 503
+    return jsonify({
+        "stream_id": stream.id,
+        "frames_url": f"{request.script_root}/api/stream/{stream.id}/frames",
+        "events_url": f"{request.script_root}/api/stream/{stream.id}/events",
+    }), 201
+
+
+@emotion_bp.route("/stream/<stream_id>/frames", methods=["POST"])
+def push_stream_frame(stream_id):
+    """Submit one frame; older frames still waiting for the model are dropped"""
+    manager = get_manager()
+    stream = manager.get(stream_id)
+    if stream is None:
+        return jsonify({"error": "Stream not found"}), 404
+
+    image = _decode_image(request.get_data(cache=False))
+    if image is None:
+        return jsonify({"error": "Unable to decode image data"}), 400
+
+    try:
+        seq = manager.push_frame(stream, image)
+    except RuntimeError as exc:
+        return jsonify({"error": str(exc)}), 410
+    return jsonify({"frame": seq, **stream.stats()}), 202
+
+
+@emotion_bp.route("/stream/<stream_id>/events", methods=["GET"])
+def stream_events(stream_id):
+    """Server-sent events with the emotion result of each processed frame"""
+    manager = get_manager()
+    stream = manager.get(stream_id)
+    if stream is None:
+        return jsonify({"error": "Stream not found"}), 404
+    return Response(
+        manager.events(stream),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@emotion_bp.route("/stream/<stream_id>", methods=["DELETE"])
+def close_stream(stream_id):
+    """Close a live emotion stream"""
+    stream = get_manager().close(stream_id)
+    if stream is None:
+        return jsonify({"error": "Stream not found"}), 404
+    return jsonify(stream.stats())
+
+
+@emotion_bp.route("/inference/stats", methods=["GET"])
+def inference_stats():
+    """Report achieved micro-batch sizes for the emotion model (never loads it)"""
+    if not config.INFERENCE_BATCHING:
+        return jsonify({"batching": False})
+    scheduler = get_scheduler(create=False)
+    if scheduler is None:
+        return jsonify({"batching": True, "started": False})
+    return jsonify({"batching": True, "started": True, **scheduler.stats()})
+
+
+@emotion_bp.route("/persistence/stats", methods=["GET"])
+def persistence_stats():
+    """Report database health, write-behind queue depth and flush latency"""
+    caches = {"users": _user_cache.stats(), "preferences": _preference_cache.stats()}
+    writer = get_writer()
+    if writer is None:
+        return jsonify({"write_behind": False, "database": db_health(), "caches": caches})
+    return jsonify({"write_behind": True, "database": db_health(), "caches": caches, **writer.stats()})
+
+
 @emotion_bp.route("/history", methods=["GET"])
 def history():
     """
     Fetch mood history for a user.
     Query params:
-    - email: user email (required)
+    - email: user email (required unless a bearer token is sent)
     - limit: max records to return (default 10, max 50)
+    - include_images: also return legacy inline image_data (default false)
+    - before: cursor from a previous page's next_before, to fetch older records
     """
-    email = request.args.get("email")
+    email, auth_error = _request_email(request.args.get("email"))
+    if auth_error:
+        return auth_error
     limit = request.args.get("limit", 10)
     
     if not email:
@@ -115,11 +466,16 @@ def history():
         return jsonify({"error": "Database connection unavailable"}), 503
     
     try:
-        records = mood_record.find_by_email(email, limit=limit)
+        records, next_before = mood_record.find_page_by_email(
+            email, limit=limit, include_images=_include_images(), before=request.args.get("before")
+        )
         return jsonify({
             "records": records,
-            "total": len(records)
+            "total": len(records),
+            "next_before": next_before
         })
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
     except Exception as e:
         current_app.logger.exception(f"Failed to fetch history: {e}")
         return jsonify({"error": "Failed to fetch history"}), 500
@@ -141,19 +497,81 @@ def get_history_record(record_id):
         return jsonify({"error": "Failed to fetch record"}), 500
 
 
+@emotion_bp.route("/images/<key>", methods=["GET"])
+def get_image(key):
+    """Serve a stored mood-record image by its content hash"""
+    store = get_image_store()
+    if store is None:
+        return jsonify({"error": "Image storage is disabled"}), 404
+    data, content_type = store.get(key)
+    if data is None:
+        return jsonify({"error": "Image not found"}), 404
+    response = Response(data, mimetype=content_type)
+    # Content-addressed, so the bytes behind a key never change
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    response.set_etag(key)
+    return response
+
+
+@emotion_bp.route("/analytics", methods=["GET"])
+def analytics():
+    """
+    Mood analytics from precomputed rollups.
+    Query params:
+    - email: user email (omit for global statistics)
+    - granularity: day (default) or hour
+    - days: window to report (default 30; max 365 for day, 14 for hour)
+    """
+    email, auth_error = _request_email(request.args.get("email"))
+    if auth_error:
+        return auth_error
+    granularity = request.args.get("granularity", "day")
+    if granularity not in ("day", "hour"):
+        return jsonify({"error": "granularity must be day or hour"}), 400
+
+    max_days = 365 if granularity == "day" else 14
+    try:
+        days = min(max_days, max(1, int(request.args.get("days", 30))))
+    except (TypeError, ValueError):
+        days = 30
+
+    if not check_db_connection() or not mood_rollup:
+        return jsonify({"error": "Database connection unavailable"}), 503
+
+    try:
+        since = datetime.utcnow() - timedelta(days=days)
+        summary = mood_rollup.summary(email=email, since=since, granularity=granularity)
+        return jsonify({
+            "scope": "user" if email else "global",
+            "email": email,
+            "granularity": granularity,
+            "days": days,
+            **summary
+        })
+    except Exception as e:
+        current_app.logger.exception(f"Failed to compute analytics: {e}")
+        return jsonify({"error": "Failed to compute analytics"}), 500
+
+
 @emotion_bp.route("/user/preferences", methods=["GET"])
 def get_user_preferences():
-    """Get user preferences by email"""
-    email = request.args.get("email")
+    """Get user preferences by email (or for the bearer token's user)"""
+    email, auth_error = _request_email(request.args.get("email"))
+    if auth_error:
+        return auth_error
     
     if not email:
         return jsonify({"error": "email parameter is required"}), 400
     
+    preferences = _preference_cache.get(email)
+    if preferences is not None:
+        return jsonify(preferences)
+    
     if not check_db_connection() or not user_preference:
         return jsonify({"error": "Database connection unavailable"}), 503
     
     try:
-        preferences = user_preference.find_by_email(email)
+        preferences = _cached_preferences(email)
         if not preferences:
             return jsonify({"error": "User preferences not found"}), 404
         return jsonify(preferences)
@@ -165,21 +583,24 @@ def get_user_preferences():
 @emotion_bp.route("/user/preferences", methods=["POST"])
 def update_user_preferences():
     """Update user preferences"""
-    payload = request.get_json(silent=True)
-    if not payload or "email" not in payload:
+    payload = request.get_json(silent=True) or {}
+    email, auth_error = _request_email(payload.get("email"))
+    if auth_error:
+        return auth_error
+    if not email:
         return jsonify({"error": "email is required"}), 400
     
     if not check_db_connection() or not user_preference:
         return jsonify({"error": "Database connection unavailable"}), 503
     
     try:
-        email = payload.get("email")
         user_preference.create_or_update(
             email=email,
             name=payload.get("name"),
             preferred_language=payload.get("preferred_language"),
             preferred_region=payload.get("preferred_region")
         )
+        _preference_cache.invalidate(email)
         return jsonify({"message": "Preferences updated successfully"}), 200
     except Exception as e:
         current_app.logger.exception(f"Failed to update preferences: {e}")
@@ -188,8 +609,13 @@ def update_user_preferences():
 
 @emotion_bp.route("/records", methods=["GET"])
 def records():
-    """Legacy endpoint for fetching records (uses MongoDB)"""
-    email = request.args.get("email")
+    """Legacy endpoint for fetching records (uses MongoDB)
+
+    Pass ?before=<cursor> from the X-Next-Before response header to page back.
+    """
+    email, auth_error = _request_email(request.args.get("email"))
+    if auth_error:
+        return auth_error
     limit = request.args.get("limit", 10)
     try:
         limit = min(50, max(1, int(limit)))
@@ -200,8 +626,19 @@ def records():
         return jsonify({"error": "Database connection unavailable"}), 503
     
     try:
-        records_list = mood_record.find_by_email(email, limit=limit) if email else mood_record.find_all(limit=limit)
-        return jsonify(records_list)
+        include_images = _include_images()
+        before = request.args.get("before")
+        records_list, next_before = (
+            mood_record.find_page_by_email(email, limit=limit, include_images=include_images, before=before)
+            if email
+            else mood_record.find_page(limit=limit, include_images=include_images, before=before)
+        )
+        response = jsonify(records_list)
+        if next_before:
+            response.headers["X-Next-Before"] = next_before
+        return response
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
     except Exception as e:
         current_app.logger.exception(f"Failed to fetch records: {e}")
         return jsonify({"error": "Failed to fetch records"}), 500
@@ -223,6 +660,8 @@ def register():
 
     if not email or not password:
         return jsonify({"error": "email and password are required"}), 400
+    if not isinstance(email, str) or not isinstance(password, str):
+        return jsonify({"error": "email and password must be strings"}), 400
 
     if not check_db_connection() or not users:
         return jsonify({"error": "Database unavailable"}), 503
@@ -235,6 +674,8 @@ def register():
         user_doc = users.create_user(name=name, email=email, password=password)
         # Do not auto-login; return success and prompt client to login
         return jsonify({"message": "Registered successfully", "user": {"email": user_doc.get('email'), "name": user_doc.get('name')}}), 201
+    except HasherBusy as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         current_app.logger.exception(f"Registration failed: {e}")
         return jsonify({"error": "Registration failed"}), 500
@@ -245,7 +686,8 @@ def login():
     """Authenticate a user.
 
     Expects JSON: { email, password }
-    Returns: user info on success
+    Returns: user info and a bearer token for the other /api routes on success
+    (no token while SECRET_KEY is unset)
     """
     payload = request.get_json(silent=True)
     if not payload:
@@ -256,18 +698,71 @@ def login():
 
     if not email or not password:
         return jsonify({"error": "email and password are required"}), 400
+    if not isinstance(email, str) or not isinstance(password, str):
+        return jsonify({"error": "email and password must be strings"}), 400
 
     if not check_db_connection() or not users:
         return jsonify({"error": "Database unavailable"}), 503
 
+    retry_after = login_limiter.hit(email.strip().lower())
+    if retry_after:
+        response = jsonify({"error": "Too many login attempts; try again later"})
+        response.headers["Retry-After"] = str(int(retry_after) + 1)
+        return response, 429
+
     try:
         ok, user_doc = users.verify_password(email, password)
         if not ok:
             return jsonify({"error": "Invalid email or password"}), 401
 
+        login_limiter.reset(email.strip().lower())
+        _user_cache.set(user_doc.get('email'), user_doc)
         # Return minimal user info
         user_info = {"email": user_doc.get('email'), "name": user_doc.get('name')}
-        return jsonify({"message": "Login successful", "user": user_info}), 200
+        if not _tokens_enabled():
+            current_app.logger.warning("SECRET_KEY is not set; login issues no bearer token")
+            return jsonify({"message": "Login successful", "user": user_info}), 200
+        token = issue_token(
+            current_app.secret_key, user_info["email"], name=user_info["name"], ttl=config.AUTH_TOKEN_TTL
+        )
+        return jsonify({
+            "message": "Login successful",
+            "user": user_info,
+            "token": token,
+            "token_type": "Bearer",
+            "expires_in": config.AUTH_TOKEN_TTL
+        }), 200
+    except HasherBusy as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         current_app.logger.exception(f"Login failed: {e}")
-        return jsonify({"error": "Login failed"}), 500
\ No newline at end of file
+        return jsonify({"error": "Login failed"}), 500
+
+
+@emotion_bp.route('/auth/me', methods=['GET'])
+def me():
+    """Return the bearer token's user and preferences (served from cache when fresh)"""
+    if not request.headers.get("Authorization"):
+        return jsonify({"error": "Authentication required"}), 401
+    email, auth_error = _request_email()
+    if auth_error:
+        return auth_error
+
+    user = _user_cache.get(email)
+    preferences = _preference_cache.get(email)
+    if user is None or preferences is None:
+        if not check_db_connection() or not users:
+            return jsonify({"error": "Database unavailable"}), 503
+        try:
+            user = _cached_user(email)
+            preferences = _cached_preferences(email)
+        except Exception as e:
+            current_app.logger.exception(f"Failed to fetch user: {e}")
+            return jsonify({"error": "Failed to fetch user"}), 500
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+
+    return jsonify({
+        "user": {"email": user.get("email"), "name": user.get("name")},
+        "preferences": preferences
+    })
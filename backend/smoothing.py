@@ -0,0 +1,95 @@
+"""
+Temporal smoothing of emotion predictions for live sessions.
+
+Per-frame predictions flicker between labels. EmotionSmoother keeps an
+exponential moving average of the 7-class probability vector and only
+switches the dominant emotion when another class leads the current one by
+``margin`` for ``min_frames`` consecutive frames, reporting ``changed`` so
+callers can fetch recommendations and persist records on real changes only.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import config
+
+
+class EmotionSmoother:
+    """EMA plus hysteresis over one session's probability vectors (not thread-safe)."""
+
+    def __init__(self, labels, alpha=0.3, margin=0.1, min_frames=3):
+        self.labels = list(labels)
+        self.alpha = alpha
+        self.margin = margin
+        self.min_frames = max(1, int(min_frames))
+        self.probabilities = None
+        self.emotion = None
+        self._candidate = None
+        self._candidate_frames = 0
+
+    def update(self, probabilities):
+        """Fold in one frame's probabilities; returns the smoothed state."""
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+        if self.probabilities is None:
+            self.probabilities = probabilities.copy()
+        else:
+            self.probabilities += self.alpha * (probabilities - self.probabilities)
+
+        leader = int(np.argmax(self.probabilities))
+        changed = False
+        if self.emotion is None:
+            self.emotion, changed = leader, True
+        elif leader != self.emotion and (
+            self.probabilities[leader] - self.probabilities[self.emotion] >= self.margin
+        ):
+            if leader == self._candidate:
+                self._candidate_frames += 1
+            else:
+                self._candidate, self._candidate_frames = leader, 1
+            if self._candidate_frames >= self.min_frames:
+                self.emotion, changed = leader, True
+        else:
+            self._candidate, self._candidate_frames = None, 0
+        if changed:
+            self._candidate, self._candidate_frames = None, 0
+
+        return {
+            "emotion": self.labels[self.emotion],
+            "confidence": float(self.probabilities[self.emotion]),
+            "probabilities": {label: round(float(p), 4) for label, p in zip(self.labels, self.probabilities)},
+            "changed": changed,
+        }
+
+
+class SmootherRegistry:
+    """Bounded, idle-expiring map of session id -> EmotionSmoother for request/response clients."""
+
+    def __init__(self, labels, max_sessions=1024, idle_timeout=300.0):
+        self.labels = labels
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def update(self, session_id, probabilities):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is None or now - entry[1] > self.idle_timeout:
+                entry = (create_smoother(self.labels), now)
+            self._sessions[session_id] = (entry[0], now)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            # Updates for one session are serialised with the registry lock.
+            return entry[0].update(probabilities)
+
+
+def create_smoother(labels):
+    return EmotionSmoother(
+        labels,
+        alpha=config.SMOOTHING_ALPHA,
+        margin=config.SMOOTHING_MARGIN,
+        min_frames=config.SMOOTHING_MIN_FRAMES,
+    )
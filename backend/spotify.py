@@ -0,0 +1,121 @@
+"""
+Shared HTTP plumbing for Spotify calls.
+
+create_session() returns a requests.Session with a keep-alive connection pool,
+a default timeout, and retries with exponential backoff on connection errors,
+429 and 5xx. Only GET and HEAD are retried after a request was sent; POSTs
+(token exchanges and refreshes) are not idempotent. Retry-After is honoured,
+capped at ``retry_after_max`` seconds.
+ClientCredentialsToken holds one app access token per process. All threads
+share it, and exactly one of them refreshes it shortly before it expires.
+"""
+import base64
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class _CappedRetry(Retry):
+    """Retry that never sleeps longer than ``retry_after_cap`` for a Retry-After header."""
+
+    def __init__(self, *args, retry_after_cap=30.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.retry_after_cap = retry_after_cap
+
+    def new(self, **kwargs):
+        # urllib3 builds a fresh Retry on every increment(); keep the cap
+        kwargs.setdefault("retry_after_cap", self.retry_after_cap)
+        return super().new(**kwargs)
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, self.retry_after_cap)
+
+
+class _TimeoutSession(requests.Session):
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def create_session(timeout=10.0, retries=3, backoff=0.5, pool_size=10, retry_after_max=30.0):
+    """
+    Pooled session; requests without an explicit timeout use ``timeout`` seconds.
+    POSTs are only retried when the connection could not be opened; use
+    retries=0 to rule out even that, e.g. for a single-use authorization code.
+    """
+    retry = _CappedRetry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUSES,
+        # A repeated token POST can burn a rotated refresh token
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+        retry_after_cap=retry_after_max,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = _TimeoutSession(timeout)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def basic_auth_header(client_id, client_secret):
+    b64 = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+    return {"Authorization": f"Basic {b64}"}
+
+
+class ClientCredentialsToken:
+    """App-level access token (client credentials flow), refreshed ``margin`` seconds before expiry."""
+
+    def __init__(self, http, token_url, client_id, client_secret, margin=60.0):
+        self.http = http
+        self.token_url = token_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.margin = margin
+        self.refreshes = 0
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def _fresh(self):
+        return self._token is not None and time.time() < self._expires_at - self.margin
+
+    def get(self):
+        if self._fresh():
+            return self._token
+        with self._lock:
+            # Another thread may have refreshed while we waited
+            if not self._fresh():
+                res = self.http.post(
+                    self.token_url,
+                    data={"grant_type": "client_credentials"},
+                    headers=basic_auth_header(self.client_id, self.client_secret),
+                )
+                res.raise_for_status()
+                payload = res.json()
+                self._token = payload["access_token"]
+                self._expires_at = time.time() + payload.get("expires_in", 3600)
+                self.refreshes += 1
+            return self._token
+
+    def headers(self):
+        return {"Authorization": f"Bearer {self.get()}"}
+
+    def invalidate(self):
+        with self._lock:
+            self._token = None
+            self._expires_at = 0.0
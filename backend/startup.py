@@ -0,0 +1,106 @@
+"""
+Startup phase for the MoodTunes backend.
+
+Heavy initialisation (storage indexes, the track catalog, loading and warming
+the emotion model) runs here instead of at import time, so lightweight routes
+can serve immediately while /api/ready reports when warm-up has finished.
+SQL tables are created on first use by db.py, the catalog by get_catalog()
+and the model on the first detection, so none of these depend on warm-up.
+"""
+import logging
+import threading
+import time
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_thread = None
+_state = {
+    "ready": False,
+    "started_at": None,
+    "finished_at": None,
+    "steps": {},
+    "error": None,
+}
+
+
+def _run_step(name, func):
+    started = time.perf_counter()
+    try:
+        func()
+        _state["steps"][name] = {"ok": True, "seconds": round(time.perf_counter() - started, 3)}
+        return True
+    except Exception as exc:
+        logger.exception("Startup step %s failed", name)
+        _state["steps"][name] = {"ok": False, "error": str(exc)}
+        return False
+
+
+def _init_storage():
+    from storage import ensure_indexes
+
+    ensure_indexes()
+
+
+def _load_catalog():
+    from catalog import get_catalog
+
+    get_catalog()
+
+
+def _warm_model():
+    from emotion import warm_up
+
+    warm_up()
+
+
+def _run():
+    _state["started_at"] = time.time()
+    _run_step("storage", _init_storage)
+    _run_step("catalog", _load_catalog)
+    model_ok = _run_step("model", _warm_model)
+    _state["finished_at"] = time.time()
+    # Readiness tracks the model: persistence failures are tolerated by the routes.
+    _state["ready"] = model_ok
+    if not model_ok:
+        _state["error"] = _state["steps"]["model"].get("error")
+
+
+def begin(mode=None):
+    """
+    Start the startup phase once per process.
+
+    ``blocking`` finishes warm-up before returning (so a worker accepts
+    traffic only when warm), ``background`` runs it on a daemon thread and
+    ``off`` only creates the storage indexes, leaving the catalog and model
+    to lazy loading on first use.
+    """
+    global _thread
+    mode = mode or config.WARMUP_MODE
+    with _lock:
+        if _thread is not None or _state["started_at"] is not None:
+            return
+        if mode == "off":
+            _state["started_at"] = time.time()
+            _run_step("storage", _init_storage)
+            _state["finished_at"] = time.time()
+            _state["ready"] = True
+            return
+        if mode == "blocking":
+            _run()
+            return
+        _thread = threading.Thread(target=_run, name="startup-warmup", daemon=True)
+        _thread.start()
+
+
+def status():
+    """Snapshot of readiness for the /api/ready endpoint."""
+    return {
+        "ready": _state["ready"],
+        "started_at": _state["started_at"],
+        "finished_at": _state["finished_at"],
+        "steps": dict(_state["steps"]),
+        "error": _state["error"],
+    }
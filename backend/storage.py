@@ -0,0 +1,29 @@
+"""
+Pluggable persistence for MoodTunes.
+
+STORAGE_BACKEND selects which module provides the repositories the routes
+use: "mongo" (mongo_db.py, the default) or "sql" (db.py, SQLAlchemy; SQLite
+by default, so single-node deployments and local testing need no external
+services). Both expose the same objects: mood_record, mood_rollup,
+user_preference, users, plus ensure_indexes(), check_db_connection(),
+report_db_error(), db_health() and TRANSIENT_ERRORS. Only the selected
+backend module is imported.
+"""
+import config
+
+if config.STORAGE_BACKEND == "sql":
+    import db as backend
+else:
+    import mongo_db as backend
+
+BACKEND = "sql" if backend.__name__ == "db" else "mongo"
+
+mood_record = backend.mood_record
+mood_rollup = backend.mood_rollup
+user_preference = backend.user_preference
+users = backend.users
+ensure_indexes = backend.ensure_indexes
+check_db_connection = backend.check_db_connection
+report_db_error = backend.report_db_error
+db_health = backend.db_health
+TRANSIENT_ERRORS = backend.TRANSIENT_ERRORS
@@ -0,0 +1,194 @@
+"""
+Live emotion streams: clients POST frames and read results as server-sent events.
+
+Each stream keeps only the newest unprocessed frame. While a frame is being
+classified, further uploads replace the pending one, so when the model falls
+behind stale frames are dropped and latency stays bounded to about one frame.
+Frames from all streams share a small worker pool. Results carry the
+stream's smoothed emotion, and a ``change`` event with fresh recommendations
+is sent only when the smoothed emotion actually changes.
+"""
+import itertools
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from emotion import EMOTION_LABELS, create_tracker, detect_emotions_from_image
+from recommendations import get_recommendations_for_emotion
+from smoothing import create_smoother
+
+logger = logging.getLogger(__name__)
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    """Return the per-process StreamManager, created on first use."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = StreamManager(
+                workers=config.STREAM_WORKERS,
+                idle_timeout=config.STREAM_IDLE_TIMEOUT,
+                max_streams=config.STREAM_MAX_STREAMS,
+            )
+        return _manager
+
+
+class EmotionStream:
+    """State for one client stream: the pending frame and undelivered results."""
+
+    def __init__(self, stream_id, max_faces=None, max_results=8):
+        self.id = stream_id
+        self.max_faces = max_faces
+        self.tracker = create_tracker()
+        self.smoother = create_smoother(EMOTION_LABELS)
+        self.created_at = self.last_seen = time.monotonic()
+        self.closed = False
+        self.busy = False
+        self.pending = None
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.results = deque(maxlen=max_results)
+        self.cond = threading.Condition()
+
+    def stats(self):
+        return {
+            "stream_id": self.id,
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            **self.tracker.stats(),
+        }
+
+
+class StreamManager:
+    """Owns live streams and the shared pool that classifies their frames."""
+
+    def __init__(self, workers=2, idle_timeout=30.0, max_streams=32, detect=detect_emotions_from_image):
+        self.detect = detect
+        self.idle_timeout = idle_timeout
+        self.max_streams = max_streams
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="emotion-stream")
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+
+    def open(self, max_faces=None):
+        with self._lock:
+            self._expire_idle()
+            if len(self._streams) >= self.max_streams:
+                raise RuntimeError("Too many active streams.")
+            stream = EmotionStream(uuid.uuid4().hex, max_faces=max_faces)
+            self._streams[stream.id] = stream
+            return stream
+
+    def get(self, stream_id):
+        with self._lock:
+            return self._streams.get(stream_id)
+
+    def close(self, stream_id):
+        with self._lock:
+            stream = self._streams.pop(stream_id, None)
+        if stream is not None:
+            with stream.cond:
+                stream.closed = True
+                stream.pending = None
+                stream.cond.notify_all()
+        return stream
+
+    def push_frame(self, stream, image):
+        """Queue ``image`` as the stream's newest frame; returns its sequence number."""
+        seq = next(self._seq)
+        with stream.cond:
+            if stream.closed:
+                raise RuntimeError("Stream is closed.")
+            stream.last_seen = time.monotonic()
+            stream.received += 1
+            if stream.pending is not None:
+                stream.dropped += 1
+            stream.pending = (seq, time.monotonic(), image)
+            if not stream.busy:
+                stream.busy = True
+                self._executor.submit(self._process, stream)
+        return seq
+
+    def _process(self, stream):
+        while True:
+            with stream.cond:
+                if stream.closed or stream.pending is None:
+                    stream.busy = False
+                    return
+                seq, received_at, image = stream.pending
+                stream.pending = None
+            try:
+                faces = self.detect(image, max_faces=stream.max_faces, tracker=stream.tracker)
+                result = {
+                    "frame": seq,
+                    "emotion": faces[0]["emotion"],
+                    "confidence": round(faces[0]["confidence"], 4),
+                    "faces": [
+                        {
+                            "emotion": face["emotion"],
+                            "confidence": round(face["confidence"], 4),
+                            "box": face["box"],
+                        }
+                        for face in faces
+                    ],
+                }
+                smoothed = stream.smoother.update(faces[0]["probabilities"])
+                result["smoothed"] = smoothed
+                if smoothed["changed"]:
+                    result["tracks"] = get_recommendations_for_emotion(smoothed["emotion"])
+            except ValueError as exc:
+                stream.tracker.reset()
+                result = {"frame": seq, "error": str(exc)}
+            except Exception:
+                logger.exception("Unexpected error processing stream frame")
+                result = {"frame": seq, "error": "Failed to detect emotion"}
+            result["latency_ms"] = round((time.monotonic() - received_at) * 1000.0, 1)
+            with stream.cond:
+                stream.processed += 1
+                stream.results.append(result)
+                stream.cond.notify_all()
+
+    def events(self, stream, heartbeat=15.0):
+        """Yield server-sent event strings with results until the stream closes."""
+        yield f"event: open\ndata: {json.dumps(stream.stats())}\n\n"
+        while True:
+            with stream.cond:
+                if not stream.results and not stream.closed:
+                    stream.cond.wait(heartbeat)
+                if stream.closed and not stream.results:
+                    break
+                results = list(stream.results)
+                stream.results.clear()
+                stream.last_seen = time.monotonic()
+            if not results:
+                yield ": keep-alive\n\n"
+            for result in results:
+                yield f"event: emotion\ndata: {json.dumps(result)}\n\n"
+                if result.get("smoothed", {}).get("changed"):
+                    change = {
+                        "frame": result["frame"],
+                        "emotion": result["smoothed"]["emotion"],
+                        "tracks": result["tracks"],
+                    }
+                    yield f"event: change\ndata: {json.dumps(change)}\n\n"
+        yield "event: close\ndata: {}\n\n"
+
+    def _expire_idle(self):
+        now = time.monotonic()
+        for stream_id, stream in list(self._streams.items()):
+            if now - stream.last_seen > self.idle_timeout:
+                self._streams.pop(stream_id)
+                with stream.cond:
+                    stream.closed = True
+                    stream.cond.notify_all()
@@ -0,0 +1,35 @@
+import csv
+
+import numpy as np
+import pytest
+
+from catalog import load_catalog
+from recommendations import EMOTIONS, FeatureMatrix, emotion_distribution, get_recommendations_for_emotion
+
+
+@pytest.mark.parametrize("confidence", [0.0, 0.2, 0.4, 0.6, 1.0])
+def test_low_confidence_keeps_the_requested_emotion(confidence):
+    tracks = get_recommendations_for_emotion("happy", limit=3, confidence=confidence)
+    assert [t["id"].split("-")[0] for t in tracks] == ["happy"] * 3
+
+
+def test_low_confidence_label_leads_the_blend():
+    dist = dict(zip(EMOTIONS, emotion_distribution("sad", confidence=0.1)))
+    assert dist["sad"] > dist["neutral"]
+    assert dist["sad"] + dist["neutral"] == pytest.approx(1.0)
+
+
+def test_feature_matrix_is_memory_mapped_for_converted_catalogs(tmp_path):
+    path = tmp_path / "tracks.csv"
+    with open(path, "w", newline="", encoding="utf-8") as fh:
+        writer = csv.DictWriter(fh, ["id", "emotion", "valence", "energy", "danceability", "acousticness"])
+        writer.writeheader()
+        for i, emotion in enumerate(EMOTIONS):
+            writer.writerow({"id": f"t{i}", "emotion": emotion, "valence": 0.1 * i, "energy": 0.5,
+                             "danceability": 0.5, "acousticness": 0.5})
+    catalog = load_catalog(str(path))
+    matrix = FeatureMatrix.for_catalog(catalog)
+    assert isinstance(matrix.rows, np.memmap)
+    np.testing.assert_array_equal(matrix.rows, FeatureMatrix.build_rows(catalog))
+    # A second process (or reload) maps the saved file instead of rebuilding
+    assert isinstance(FeatureMatrix.for_catalog(load_catalog(str(path))).rows, np.memmap)
@@ -0,0 +1,44 @@
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Settings are read at import time, so the app runs in a fresh interpreter
+REGISTER_SCRIPT = """
+import json
+import app
+client = app.app.test_client()
+register = client.post("/api/auth/register", json={"email": "a@example.com", "password": "secret-pw", "name": "A"})
+login = client.post("/api/auth/login", json={"email": "a@example.com", "password": "secret-pw"})
+ready = client.get("/api/ready")
+print(json.dumps({
+    "register": register.status_code,
+    "login": login.status_code,
+    "ready": ready.status_code,
+    "steps": ready.get_json()["steps"],
+}))
+"""
+
+
+def test_warmup_off_serves_registration(tmp_path):
+    env = dict(
+        os.environ,
+        STORAGE_BACKEND="sql",
+        DATABASE_URL=f"sqlite:///{tmp_path / 'moodtunes.db'}",
+        WARMUP_MODE="off",
+        PASSWORD_HASH_METHOD="pbkdf2:sha256:1000",
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", REGISTER_SCRIPT],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    status = json.loads(result.stdout.strip().splitlines()[-1])
+    assert status["register"] == 201
+    assert status["login"] == 200
+    assert status["ready"] == 200
+    assert status["steps"]["storage"]["ok"]
+    # The catalog and model stay lazy
+    assert set(status["steps"]) == {"storage"}
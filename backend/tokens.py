@@ -0,0 +1,65 @@
+"""
+Stateless session tokens for the /api routes.
+
+Tokens are compact HS256 JWTs signed with the Flask ``app.secret_key``:
+base64url(header).base64url(claims).base64url(HMAC-SHA256). Claims are
+``sub`` (the user's email), ``name``, ``iat`` and ``exp``. Verifying a token
+needs no database lookup.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+_HEADER = {"alg": "HS256", "typ": "JWT"}
+
+
+class InvalidToken(ValueError):
+    """Raised for malformed, tampered or expired tokens."""
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(secret, signing_input):
+    if isinstance(secret, str):
+        secret = secret.encode("utf-8")
+    return hmac.new(secret, signing_input, hashlib.sha256).digest()
+
+
+def issue_token(secret, email, name=None, ttl=86400):
+    """Return a signed token for ``email`` valid for ``ttl`` seconds."""
+    now = int(time.time())
+    claims = {"sub": email, "name": name, "iat": now, "exp": now + int(ttl)}
+    signing_input = ".".join(
+        _b64encode(json.dumps(part, separators=(",", ":")).encode("utf-8")) for part in (_HEADER, claims)
+    ).encode("ascii")
+    return f"{signing_input.decode('ascii')}.{_b64encode(_sign(secret, signing_input))}"
+
+
+def verify_token(secret, token):
+    """Return the claims of a valid token; raises InvalidToken otherwise."""
+    try:
+        header_b64, claims_b64, signature_b64 = token.split(".")
+        signature = _b64decode(signature_b64)
+        header = json.loads(_b64decode(header_b64))
+        claims = json.loads(_b64decode(claims_b64))
+    except (AttributeError, ValueError):
+        raise InvalidToken("Malformed token")
+
+    if not isinstance(header, dict) or header.get("alg") != "HS256":
+        raise InvalidToken("Unsupported token algorithm")
+    expected = _sign(secret, f"{header_b64}.{claims_b64}".encode("ascii"))
+    if not hmac.compare_digest(signature, expected):
+        raise InvalidToken("Invalid token signature")
+    if not isinstance(claims, dict) or not claims.get("sub"):
+        raise InvalidToken("Token has no subject")
+    if int(claims.get("exp", 0)) < time.time():
+        raise InvalidToken("Token expired")
+    return claims
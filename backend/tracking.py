@@ -0,0 +1,93 @@
+"""
+Face tracking between frames for live video.
+
+Running the face detector on every frame is the most expensive step of the
+live pipeline. FaceTracker runs it only every ``detect_every`` frames, or
+when a face is lost, and in between follows each face by template matching
+inside a small window around its previous position.
+"""
+import cv2
+import numpy as np
+
+
+class FaceTracker:
+    """Detect-then-track face boxes for a single video source (not thread-safe)."""
+
+    def __init__(self, detect_fn, detect_every=10, min_score=0.6, search_margin=0.5, max_side=320):
+        """
+        ``detect_fn(image, gray)`` returns (x, y, w, h) boxes for a full frame.
+        Tracking runs on a copy of the frame downscaled to ``max_side`` pixels.
+        """
+        self.detect_fn = detect_fn
+        self.detect_every = max(1, int(detect_every))
+        self.min_score = min_score
+        self.search_margin = search_margin
+        self.max_side = max_side
+        self._frames_since_detect = 0
+        self._tracks = []  # (box in working coordinates, template)
+        self.detections = 0
+        self.tracked_frames = 0
+
+    def reset(self):
+        self._tracks = []
+        self._frames_since_detect = 0
+
+    def _working_scale(self, gray):
+        longest = max(gray.shape[:2])
+        if self.max_side and longest > self.max_side:
+            return self.max_side / float(longest)
+        return 1.0
+
+    def update(self, image, gray):
+        """Return face boxes (x, y, w, h) in full-frame coordinates for this frame."""
+        scale = self._working_scale(gray)
+        small = gray if scale == 1.0 else cv2.resize(
+            gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+        )
+
+        if self._tracks and self._frames_since_detect < self.detect_every:
+            tracks = self._track(small)
+            if tracks is not None:
+                self._tracks = tracks
+                self._frames_since_detect += 1
+                self.tracked_frames += 1
+                return [self._to_frame(box, scale) for box, _ in tracks]
+
+        boxes = self.detect_fn(image, gray)
+        self.detections += 1
+        self._frames_since_detect = 1
+        self._tracks = []
+        for box in boxes:
+            x, y, w, h = (int(round(v * scale)) for v in box)
+            template = small[y : y + h, x : x + w]
+            if template.size and w > 1 and h > 1:
+                self._tracks.append(((x, y, w, h), template.copy()))
+        return [tuple(box) for box in boxes]
+
+    def _track(self, small):
+        """Follow every tracked face; None when any of them is lost."""
+        height, width = small.shape[:2]
+        tracks = []
+        for (x, y, w, h), template in self._tracks:
+            mx, my = int(w * self.search_margin), int(h * self.search_margin)
+            x0, y0 = max(0, x - mx), max(0, y - my)
+            x1, y1 = min(width, x + w + mx), min(height, y + h + my)
+            window = small[y0:y1, x0:x1]
+            if window.shape[0] < h or window.shape[1] < w:
+                return None
+            scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (dx, dy) = cv2.minMaxLoc(scores)
+            if not np.isfinite(score) or score < self.min_score:
+                return None
+            box = (x0 + dx, y0 + dy, w, h)
+            tracks.append((box, small[box[1] : box[1] + h, box[0] : box[0] + w].copy()))
+        return tracks
+
+    @staticmethod
+    def _to_frame(box, scale):
+        if scale == 1.0:
+            return tuple(box)
+        return tuple(int(round(v / scale)) for v in box)
+
+    def stats(self):
+        return {"detections": self.detections, "tracked_frames": self.tracked_frames}
@@ -0,0 +1,194 @@
+"""
+Write-behind persistence of mood records and user preferences.
+
+/api/detect enqueues its writes and responds immediately; a background
+thread drains the queue into one batched insert (mood records) and one
+batch of upserts (preferences) per flush, triggered when ``batch_size``
+writes are pending or ``flush_interval`` seconds have passed. The storage
+backend's transient errors are retried with backoff, and the queue is
+flushed on shutdown. Documents given up on are reported to the callbacks
+registered with add_failure_listener().
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """Batches mood-record inserts and preference upserts off the request path."""
+
+    def __init__(self, mood_records, preferences, batch_size=100, flush_interval=0.5,
+                 max_queue=10000, max_retries=3, retry_backoff=0.2, transient_errors=(),
+                 on_error=None, on_dropped=None):
+        self.mood_records = mood_records
+        self.preferences = preferences
+        self.transient_errors = tuple(transient_errors)
+        self.on_error = on_error
+        # on_dropped(kind, documents) for documents that could not be written
+        self.on_dropped = on_dropped
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.01, float(flush_interval))
+        self.max_retries = max(0, int(max_retries))
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._lock = threading.Lock()
+        self._metrics = {
+            "enqueued": 0,
+            "rejected": 0,
+            "written": 0,
+            "failed": 0,
+            "retries": 0,
+            "flushes": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+        self._worker = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._worker.start()
+
+    def submit(self, kind, document):
+        """
+        Queue a ``"mood_record"`` or ``"preference"`` document (from the model's
+        build()). Returns False when the queue is full or closed so the caller
+        can write synchronously instead.
+        """
+        if self._closed:
+            return False
+        try:
+            self._queue.put_nowait((kind, document))
+        except queue.Full:
+            with self._lock:
+                self._metrics["rejected"] += 1
+            return False
+        with self._lock:
+            self._metrics["enqueued"] += 1
+        return True
+
+    def _drain(self):
+        """Block for the first item, then collect up to batch_size until the interval ends."""
+        try:
+            items = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(items) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while not (self._closed and self._queue.empty()):
+            items = self._drain()
+            if items:
+                self._flush(items)
+
+    def _with_retries(self, write, documents):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return write(documents)
+            except self.transient_errors:
+                if attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self._metrics["retries"] += 1
+                time.sleep(self.retry_backoff * (2 ** attempt))
+
+    def _flush(self, items):
+        started = time.perf_counter()
+        records = [doc for kind, doc in items if kind == "mood_record"]
+        preferences = [doc for kind, doc in items if kind == "preference"]
+        written = failed = 0
+        for kind, write, documents in (("mood_record", self.mood_records.create_many, records),
+                                       ("preference", self.preferences.bulk_upsert, preferences)):
+            if not documents:
+                continue
+            try:
+                self._with_retries(write, documents)
+                written += len(documents)
+            except Exception as exc:
+                logger.exception("Write-behind flush of %d documents failed", len(documents))
+                failed += len(documents)
+                if self.on_error is not None:
+                    self.on_error(exc)
+                if self.on_dropped is not None:
+                    self.on_dropped(kind, documents)
+        elapsed = (time.perf_counter() - started) * 1000.0
+        with self._lock:
+            metrics = self._metrics
+            metrics["written"] += written
+            metrics["failed"] += failed
+            metrics["flushes"] += 1
+            metrics["last_flush_ms"] = elapsed
+            metrics["max_flush_ms"] = max(metrics["max_flush_ms"], elapsed)
+            metrics["total_flush_ms"] += elapsed
+
+    def shutdown(self, timeout=10.0):
+        """Stop accepting writes and flush whatever is queued."""
+        self._closed = True
+        self._worker.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        total = metrics.pop("total_flush_ms")
+        metrics["avg_flush_ms"] = (total / metrics["flushes"]) if metrics["flushes"] else 0.0
+        metrics["queue_depth"] = self._queue.qsize()
+        metrics["batch_size"] = self.batch_size
+        metrics["flush_interval"] = self.flush_interval
+        return metrics
+
+
+_writer = None
+_writer_lock = threading.Lock()
+_failure_listeners = []
+
+
+def add_failure_listener(callback):
+    """Call ``callback(kind, documents)`` when queued documents are dropped (e.g. to drop cached copies)."""
+    _failure_listeners.append(callback)
+
+
+def _notify_dropped(kind, documents):
+    for callback in list(_failure_listeners):
+        try:
+            callback(kind, documents)
+        except Exception:
+            logger.exception("Write-behind failure listener failed")
+
+
+def get_writer():
+    """Return the process-wide write-behind queue, or None when disabled or without a DB."""
+    global _writer
+    if not config.WRITE_BEHIND:
+        return None
+    with _writer_lock:
+        if _writer is None:
+            from storage import TRANSIENT_ERRORS, mood_record, report_db_error, user_preference
+
+            if mood_record is None or user_preference is None:
+                return None
+            _writer = WriteBehindQueue(
+                mood_record,
+                user_preference,
+                batch_size=config.WRITE_BEHIND_BATCH_SIZE,
+                flush_interval=config.WRITE_BEHIND_FLUSH_INTERVAL,
+                max_queue=config.WRITE_BEHIND_MAX_QUEUE,
+                max_retries=config.WRITE_BEHIND_MAX_RETRIES,
+                transient_errors=TRANSIENT_ERRORS,
+                on_error=report_db_error,
+                on_dropped=_notify_dropped,
+            )
+            atexit.register(_writer.shutdown)
+        return _writer